@@ -0,0 +1,113 @@
+import numpy as np
+
+# Global data association between tracked targets and the detections of a
+# frame. Costs are computed for every (target, detection) pair at once, pairs
+# outside the gate are ruled out, and every detection goes to at most one
+# target, either greedily cheapest pair first or with the optimal (Hungarian)
+# assignment.
+
+
+def distance_costs(target_rows, target_cols, scales, rows, cols):
+    # (targets, detections) matrix of squared distances between the targets and
+    # the detections, in units of the per target scale
+    target_rows = np.asarray(target_rows, dtype=float)[:, None]
+    target_cols = np.asarray(target_cols, dtype=float)[:, None]
+    scales = np.asarray(scales, dtype=float)[:, None]
+    rows = np.asarray(rows, dtype=float)[None, :]
+    cols = np.asarray(cols, dtype=float)[None, :]
+    return ((rows - target_rows) ** 2 + (cols - target_cols) ** 2) / scales ** 2
+
+
+def assign(costs, gate, method="greedy"):
+    # Match targets (rows of costs) with detections (columns), each at most
+    # once, leaving out pairs that cost more than gate. Returns the (target,
+    # detection) index arrays of the matched pairs.
+    if method not in ("greedy", "hungarian"):
+        raise ValueError("Unknown association method: %s" % method)
+    costs = np.asarray(costs, dtype=float)
+    if costs.size == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    if method == "greedy":
+        return greedy_assignment(costs, gate)
+    return optimal_assignment(costs, gate)
+
+
+def greedy_assignment(costs, gate):
+    # Take the cheapest remaining pair until none is inside the gate
+    targets, detections = np.nonzero(costs <= gate)
+    order = np.argsort(costs[targets, detections], kind="stable")
+    used_targets = np.zeros(costs.shape[0], dtype=bool)
+    used_detections = np.zeros(costs.shape[1], dtype=bool)
+    matched = []
+    for t, d in zip(targets[order].tolist(), detections[order].tolist()):
+        if not used_targets[t] and not used_detections[d]:
+            used_targets[t] = used_detections[d] = True
+            matched.append((t, d))
+    matched = np.array(matched, dtype=np.intp).reshape(-1, 2)
+    return matched[:, 0], matched[:, 1]
+
+
+def optimal_assignment(costs, gate):
+    # Minimum total cost assignment (Hungarian method with potentials, O(n^2 m)
+    # for n <= m), pairs outside the gate costing more than any gated
+    # assignment and being dropped afterwards
+    transposed = costs.shape[0] > costs.shape[1]
+    gated = costs.T if transposed else costs
+    outside = gated > gate
+    penalty = (gate + 1) * (min(gated.shape) + 1)
+    gated = np.where(outside, penalty, gated)
+
+    n, m = gated.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.intp)      # row matched to every column, 1 based
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        reduced = np.full(m + 1, np.inf)
+        previous = np.zeros(m + 1, dtype=np.intp)
+        visited = np.zeros(m + 1, dtype=bool)
+        while owner[column]:
+            visited[column] = True
+            current = owner[column]
+            candidates = gated[current - 1] - u[current] - v[1:]
+            free = ~visited[1:]
+            improved = free & (candidates < reduced[1:])
+            reduced[1:][improved] = candidates[improved]
+            previous[1:][improved] = column
+            masked = np.where(free, reduced[1:], np.inf)
+            next_column = int(np.argmin(masked)) + 1
+            delta = masked[next_column - 1]
+            u[owner[visited]] += delta
+            v[visited] -= delta
+            reduced[1:][free] -= delta
+            column = next_column
+        while column:
+            owner[column] = owner[previous[column]]
+            column = previous[column]
+
+    columns = np.flatnonzero(owner[1:])
+    rows = owner[1:][columns] - 1
+    keep = ~outside[rows, columns]
+    rows, columns = rows[keep], columns[keep]
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows, kind="stable")
+    return rows[order], columns[order]
+
+
+def suppress_duplicates(rows, cols, radii):
+    # Mask of the detections to keep when several land on the same cross: a
+    # detection whose center falls inside the box (center +/- radius) of an
+    # earlier kept one is dropped
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    radii = np.asarray(radii)
+    inside = ((np.abs(rows[:, None] - rows[None, :]) < radii[None, :]) &
+              (np.abs(cols[:, None] - cols[None, :]) < radii[None, :]))
+    keep = np.ones(len(rows), dtype=bool)
+    for i in range(len(rows)):
+        if keep[i]:
+            later = inside[i + 1:, i]
+            keep[i + 1:][later] = False
+    return keep
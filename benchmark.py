@@ -0,0 +1,200 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+import tracker
+import tracker_stats
+
+# Benchmark harness for the tracker over the bundled test images. Times
+# Tracker.scan, Tracker.update_targets and pinpoint_target separately for every
+# combination of parameter set and resolution, and writes the results as JSON so
+# runs from different commits can be compared.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same constants as mbot_tracking.py unless overridden on the command line
+DEFAULT_PARAMS = {
+    "scan_offset": (4, 4),
+    "target_offset": 5,
+    "threshhold": 35,
+    "tracking_offset": 20,
+    "tracking_timeout": 15,
+}
+BORDER = (20, 20, 20, 20)
+PERCENTILES = (50, 90, 99)
+
+
+def load_images(paths):
+    # Load every image once, converted to grayscale the same way mbot_tracking.py
+    # does it
+    images = {}
+    for path in paths:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            raise IOError("Could not read image: %s" % path)
+        images[os.path.basename(path)] = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    return images
+
+
+def resize(image, resolution):
+    if image.shape[1] == resolution[0] and image.shape[0] == resolution[1]:
+        return image
+    return cv2.resize(image, tuple(resolution), interpolation=cv2.INTER_AREA)
+
+
+def latency_summary(samples):
+    # Per-call latency in milliseconds
+    if not samples:
+        return {"calls": 0}
+
+    samples = np.array(samples) * 1000
+    summary = {"calls": len(samples), "mean_ms": float(samples.mean()), "max_ms": float(samples.max())}
+    for p in PERCENTILES:
+        summary["p%d_ms" % p] = float(np.percentile(samples, p))
+    return summary
+
+
+def scan_triggers(frame, params):
+    # Trigger points of a full scan of the frame, the candidates pinpoint_target
+    # gets to verify
+    rows = np.arange(BORDER[0], frame.shape[0] - BORDER[1], params["scan_offset"][0])
+    cols = np.arange(BORDER[2], frame.shape[1] - BORDER[3], params["scan_offset"][1])
+    return tracker.gradient_triggers(frame, rows, cols, params["scan_offset"][1], params["threshhold"])
+
+
+def run_case(images, params, resolution, repeat, backend, cascade=(), precompute=False, adaptive_threshhold=False,
+             detector="raster", pyramid_levels=0):
+    # Time every operation for one parameter set and resolution over all images
+    scan_samples = []
+    update_samples = []
+    pinpoint_samples = []
+    triggers = 0
+    targets_found = 0
+    per_image = {}
+
+    for name, image in images.items():
+        frame = resize(image, resolution)
+        image_targets = 0
+        for _ in range(repeat):
+            t = tracker.Tracker(params["scan_offset"], params["target_offset"], params["threshhold"],
+                                params["tracking_offset"], params["tracking_timeout"], backend=backend,
+                                cascade=cascade, precompute=precompute, adaptive_threshhold=adaptive_threshhold,
+                                detector=detector, pyramid_levels=pyramid_levels)
+            start = time.perf_counter()
+            t.scan(frame, BORDER)
+            scan_samples.append(time.perf_counter() - start)
+            image_targets = len(t.get_target_centers())
+
+            # Tracking the same frame again keeps the number of targets stable
+            start = time.perf_counter()
+            t.update_targets(frame)
+            update_samples.append(time.perf_counter() - start)
+
+            # Verify every scan trigger on its own. The precomputed maps of the
+            # frame are shared by all of them, the first call paying for the build.
+            trigger_rows, trigger_cols = scan_triggers(frame, params)
+            maps = t.frame_maps(frame)
+            for r, c in zip(trigger_rows.tolist(), trigger_cols.tolist()):
+                start = time.perf_counter()
+                t.pinpoint_target(frame, r, c, maps)
+                pinpoint_samples.append(time.perf_counter() - start)
+            triggers += len(trigger_rows)
+
+        targets_found += image_targets
+        per_image[name] = image_targets
+
+    return {
+        "params": dict(params, scan_offset=list(params["scan_offset"])),
+        "resolution": list(resolution),
+        "scan": latency_summary(scan_samples),
+        "update_targets": latency_summary(update_samples),
+        "pinpoint_target": latency_summary(pinpoint_samples),
+        "triggers_examined": triggers // repeat,
+        "targets_found": targets_found,
+        "targets_per_image": per_image,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_pair(text):
+    first, second = text.lower().replace("x", ",").split(",")
+    return (int(first), int(second))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker on the bundled test images")
+    parser.add_argument("images", nargs="*", help="images to benchmark (default: all JPGs in the repo)")
+    parser.add_argument("--scan-offset", nargs="+", type=parse_pair, default=[DEFAULT_PARAMS["scan_offset"]],
+                        help="scan offsets as row,col")
+    parser.add_argument("--threshhold", nargs="+", type=int, default=[DEFAULT_PARAMS["threshhold"]])
+    parser.add_argument("--resolution", nargs="+", type=parse_pair, default=[(640, 480)],
+                        help="resolutions as WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per image and parameter set")
+    parser.add_argument("--backend", default="python", choices=("python", "numba"))
+    parser.add_argument("--cascade", nargs="+", default=[], choices=tuple(tracker_stats.STAGES),
+                        help="early-reject stages every trigger has to pass before it is verified")
+    parser.add_argument("--precompute", action="store_true",
+                        help="share per frame edge and minimum tables between the pinpoints of a frame")
+    parser.add_argument("--adaptive-threshhold", action="store_true",
+                        help="per block threshholds from the local contrast instead of --threshhold")
+    parser.add_argument("--detector", default="raster", choices=("raster", "template"), help="cross detector")
+    parser.add_argument("--pyramid-levels", type=int, default=0,
+                        help="halve the frame this many times to detect crosses before refining them")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    paths = args.images or sorted(glob.glob(os.path.join(REPO_DIR, "*.jpg")))
+    images = load_images(paths)
+
+    cases = []
+    for resolution in args.resolution:
+        for scan_offset in args.scan_offset:
+            for threshhold in args.threshhold:
+                params = dict(DEFAULT_PARAMS, scan_offset=scan_offset, threshhold=threshhold)
+                case = run_case(images, params, resolution, args.repeat, args.backend, args.cascade, args.precompute,
+                                args.adaptive_threshhold, args.detector, args.pyramid_levels)
+                cases.append(case)
+                print("%dx%d scan_offset=%s threshhold=%d: scan p50 %.1f ms p99 %.1f ms, "
+                      "update p50 %.2f ms, pinpoint p50 %.3f ms, %d triggers, %d targets" % (
+                          resolution[0], resolution[1], scan_offset, threshhold,
+                          case["scan"]["p50_ms"], case["scan"]["p99_ms"],
+                          case["update_targets"]["p50_ms"],
+                          case["pinpoint_target"].get("p50_ms", 0.0),
+                          case["triggers_examined"], case["targets_found"]))
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "backend": args.backend,
+        "cascade": args.cascade,
+        "precompute": args.precompute,
+        "adaptive_threshhold": args.adaptive_threshhold,
+        "detector": args.detector,
+        "pyramid_levels": args.pyramid_levels,
+        "repeat": args.repeat,
+        "images": sorted(images),
+        "cases": cases,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
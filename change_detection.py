@@ -0,0 +1,75 @@
+import numpy as np
+
+# Block-wise change detection between frames. Frames are decimated and compared
+# to a reference in blocks of block_size x block_size pixels; a block changed
+# when its mean absolute difference is above the threshhold. The reference is
+# only replaced where the caller accepts the current frame, so every region is
+# compared against the frame it was last processed in.
+
+
+class ChangeDetector:
+    def __init__(self, threshhold=6, block_size=16, decimation=4):
+        self.threshhold = threshhold
+        self.block_size = block_size
+        self.decimation = decimation
+        self.__reference = None
+        self.__current = None
+
+    def changes(self, image):
+        # Boolean (block rows, block columns) mask of the blocks of image that
+        # changed since they were accepted. Everything changed without a
+        # reference.
+        self.__current = image[::self.decimation, ::self.decimation].astype(np.int16)
+        cells = self.block_size // self.decimation
+        row_starts = np.arange(0, self.__current.shape[0], cells)
+        col_starts = np.arange(0, self.__current.shape[1], cells)
+        if self.__reference is None or self.__reference.shape != self.__current.shape:
+            self.__reference = None
+            return np.ones((len(row_starts), len(col_starts)), dtype=bool)
+
+        difference = np.abs(self.__current - self.__reference).astype(np.int32)
+        sums = np.add.reduceat(np.add.reduceat(difference, row_starts, axis=0), col_starts, axis=1)
+        counts = np.outer(np.diff(np.append(row_starts, difference.shape[0])),
+                          np.diff(np.append(col_starts, difference.shape[1])))
+        return sums > self.threshhold * counts
+
+    def accept(self, top=0, bottom=None, left=0, right=None):
+        # Make the window [top, bottom) x [left, right) of the last frame passed
+        # to changes the reference for that window, by default whole rows
+        if self.__reference is None:
+            # Pixels that were never accepted stay changed
+            self.__reference = np.full_like(self.__current, -256)
+
+        top = -(-top // self.decimation)
+        bottom = None if bottom is None else -(-bottom // self.decimation)
+        left = -(-left // self.decimation)
+        right = None if right is None else -(-right // self.decimation)
+        self.__reference[top:bottom, left:right] = self.__current[top:bottom, left:right]
+
+    def grid_mask(self, rows, cols, changed, dilation=1):
+        # Mask of the grid points rows x cols that fall in a changed block or
+        # within dilation blocks of one
+        if dilation:
+            changed = dilate(changed, dilation)
+        block_rows = np.minimum(np.asarray(rows) // self.block_size, changed.shape[0] - 1)
+        block_cols = np.minimum(np.asarray(cols) // self.block_size, changed.shape[1] - 1)
+        return changed[np.ix_(block_rows, block_cols)]
+
+    def window_changed(self, changed, top, bottom, left, right):
+        # Whether any block overlapping the pixel window changed
+        return bool(changed[top // self.block_size:-(-bottom // self.block_size),
+                            left // self.block_size:-(-right // self.block_size)].any())
+
+
+def dilate(mask, blocks):
+    # Grow the True regions of a 2D mask by the given number of cells in every
+    # direction, diagonals included
+    grown = mask.copy()
+    for _ in range(blocks):
+        rows = grown.copy()
+        rows[1:] |= grown[:-1]
+        rows[:-1] |= grown[1:]
+        grown = rows.copy()
+        grown[:, 1:] |= rows[:, :-1]
+        grown[:, :-1] |= rows[:, 1:]
+    return grown
@@ -0,0 +1,151 @@
+import threading
+import time
+
+import numpy as np
+
+from lcmtypes.simple_motor_command_t import simple_motor_command_t
+
+# Visual servoing for the follow mode. The tracking loop hands every tracked
+# frame to a FollowController, which keeps following one target by id. A
+# ControlLoop thread turns the controller output into motor commands at a
+# fixed rate of its own, so commands neither wait for the next frame nor stop
+# when tracking stalls. The frame timestamps make up for the latency: the
+# target is extrapolated from the frame it was seen in to the moment the
+# command is sent.
+
+CHANNEL = "MBOT_MOTOR_COMMAND_SIMPLE"
+
+
+class FollowController:
+    def __init__(self, resolution, target_radius=40, forward_gain=0.5, angular_gain=1.0, max_forward=0.3,
+                 max_angular=1.0, deadband=0.05, smoothing=0.5, max_extrapolation=0.2, timeout=0.5):
+        # resolution is the (width, height) of the frames. The robot turns
+        # toward the target with angular_gain rad/s per half image width of
+        # offset and drives until the target radius is target_radius pixels,
+        # with forward_gain m/s per relative radius error. Offsets within the
+        # deadband (a fraction of the half width or of the target radius) are
+        # ignored. Velocities of the target are smoothed by smoothing (0 keeps
+        # only the newest estimate), extrapolated for at most max_extrapolation
+        # seconds, and the robot stops when the target has not been seen for
+        # timeout seconds.
+        self.width, self.height = resolution
+        self.target_radius = target_radius
+        self.forward_gain = forward_gain
+        self.angular_gain = angular_gain
+        self.max_forward = max_forward
+        self.max_angular = max_angular
+        self.deadband = deadband
+        self.smoothing = smoothing
+        self.max_extrapolation = max_extrapolation
+        self.timeout = timeout
+
+        self.__lock = threading.Lock()
+        self.__target_id = None
+        # (timestamp, row, column, radius) the target was last seen at, and its
+        # (row, column, radius) velocity in pixels per second
+        self.__observation = None
+        self.__velocity = np.zeros(3)
+
+    def observe(self, timestamp, targets):
+        # Take the targets of the frame captured at timestamp, an (n, 4) array
+        # of (id, center_row, center_col, radius) like Tracker.get_target_array.
+        # The followed target is kept while it is tracked, otherwise the
+        # largest (closest) target is followed.
+        targets = np.asarray(targets).reshape(-1, 4)
+        with self.__lock:
+            if not len(targets):
+                return
+            followed = np.flatnonzero(targets[:, 0] == self.__target_id)
+            row = targets[followed[0] if len(followed) else int(np.argmax(targets[:, 3]))]
+            location = row[1:].astype(float)
+
+            previous = self.__observation
+            if len(followed) and previous is not None and timestamp > previous[0]:
+                velocity = (location - previous[1:]) / (timestamp - previous[0])
+                self.__velocity = self.smoothing * self.__velocity + (1 - self.smoothing) * velocity
+            elif not len(followed):
+                self.__velocity = np.zeros(3)
+            self.__target_id = int(row[0])
+            self.__observation = (timestamp,) + tuple(location)
+
+    def predict(self, now):
+        # Extrapolated (row, column, radius) of the followed target at time now,
+        # or None when it has not been seen for timeout seconds
+        with self.__lock:
+            if self.__observation is None or now - self.__observation[0] > self.timeout:
+                return None
+            elapsed = min(max(now - self.__observation[0], 0), self.max_extrapolation)
+            return np.array(self.__observation[1:]) + self.__velocity * elapsed
+
+    def velocities(self, now):
+        # (forward, angular) velocity to send at time now, zero without a target
+        location = self.predict(now)
+        if location is None:
+            return (0.0, 0.0)
+        _, column, radius = location
+
+        # Turning left is a positive angular velocity
+        offset = (self.width / 2 - column) / (self.width / 2)
+        angular = 0.0 if abs(offset) < self.deadband else self.angular_gain * offset
+
+        # Drive in while the target looks small, back off when it is too close,
+        # and slow down while it is far off center
+        error = (self.target_radius - radius) / self.target_radius
+        forward = 0.0 if abs(error) < self.deadband else self.forward_gain * error
+        forward *= max(1 - abs(offset), 0)
+
+        return (float(np.clip(forward, -self.max_forward, self.max_forward)),
+                float(np.clip(angular, -self.max_angular, self.max_angular)))
+
+    def target_id(self):
+        # Id of the followed target, or None
+        with self.__lock:
+            return self.__target_id
+
+
+class ControlLoop(threading.Thread):
+    # Publish the commands of a FollowController at rate Hz on its own thread,
+    # and a stop command when the loop ends
+    def __init__(self, follow_controller, publisher, rate=30, channel=CHANNEL):
+        super().__init__(name="control", daemon=True)
+        self.controller = follow_controller
+        self.stopped = threading.Event()
+        self.error = None
+        self.count = 0
+        self.__publisher = publisher
+        self.__period = 1.0 / rate
+        self.__channel = channel
+
+    def observe(self, timestamp, targets):
+        self.controller.observe(timestamp, targets)
+
+    def run(self):
+        # Ticks are scheduled from the start time, so a slow tick does not
+        # shift the ones after it. Ticks missed by a stall are skipped rather
+        # than sent in a burst.
+        next_tick = time.monotonic()
+        try:
+            while not self.stopped.is_set():
+                self.__publish(*self.controller.velocities(time.time()))
+                next_tick += self.__period
+                delay = next_tick - time.monotonic()
+                if delay < 0:
+                    next_tick = time.monotonic()
+                self.stopped.wait(max(delay, 0))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopped.set()
+            if self.error is None:
+                self.__publish(0.0, 0.0)
+
+    def stop(self):
+        self.stopped.set()
+
+    def __publish(self, forward, angular):
+        command = simple_motor_command_t()
+        command.utime = int(time.time() * 1000000)
+        command.forward_velocity = forward
+        command.angular_velocity = angular
+        self.__publisher.publish(self.__channel, command.encode())
+        self.count += 1
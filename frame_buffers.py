@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+# Preallocated frame buffers for the tracking loop. The grayscale frame is a
+# uint8 buffer reused every frame: either a view of the luma plane of a YUV
+# capture or an in-place weighted conversion of an RGB capture. The display
+# buffer is only filled when something is drawn.
+
+
+class FrameBuffers:
+    def __init__(self, resolution):
+        width, height = resolution
+        self.resolution = (width, height)
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.rgb = np.empty((height, width, 3), dtype=np.uint8)
+
+    def to_gray(self, frame, frame_format="rgb"):
+        # Grayscale uint8 version of the frame, without allocating a new array
+        if frame_format == "yuv":
+            # The luma plane is the grayscale image already
+            return yuv_luma(frame, self.resolution)
+
+        cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=self.gray)
+        return self.gray
+
+    def to_rgb(self, frame, frame_format="rgb"):
+        # RGB version of the frame for drawing. RGB frames are drawn on in place.
+        if frame_format == "yuv":
+            if frame.shape[1] == self.rgb.shape[1] and frame.shape[0] * 2 // 3 == self.rgb.shape[0]:
+                cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_I420, dst=self.rgb)
+                return self.rgb
+
+            # Padded frames are converted whole and cropped
+            width, height = self.resolution
+            self.rgb[...] = cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_I420)[:height, :width]
+            return self.rgb
+        return frame
+
+
+def yuv_buffer(resolution):
+    # Buffer for a YUV420 capture. The camera pads the width to a multiple of 32
+    # and the height to a multiple of 16.
+    width, height = padded_resolution(resolution)
+    return np.empty((height * 3 // 2, width), dtype=np.uint8)
+
+
+def padded_resolution(resolution):
+    width, height = resolution
+    return ((width + 31) // 32 * 32, (height + 15) // 16 * 16)
+
+
+def yuv_luma(frame, resolution):
+    # View of the luma plane of a padded YUV420 frame
+    width, height = resolution
+    return frame[:height, :width]
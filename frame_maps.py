@@ -0,0 +1,155 @@
+import numpy as np
+
+# Per frame precomputation shared by every pinpoint of a frame. The edges of
+# every row and column at the pinpoint sampling step, the running counts to find
+# the next or previous edge of a line, and range minimum tables of the pixels
+# are built once, so following a bar becomes a few lookups per row instead of
+# sampling and differencing the row again for every candidate. Everything is
+# built lazily on first use.
+
+
+class LineMaps:
+    # Edges and intensities of every line (row of lines) sampled every step
+    # pixels. Positions of one line are only compared with the positions of the
+    # same lattice (same remainder modulo step), like edge_profile samples them.
+    def __init__(self, lines, step, threshhold):
+        self.step = step
+        self.length = lines.shape[1]
+
+        # Gradient of every pixel with the pixel one step before, which wraps
+        # around at the start of the line like scalar indexing does. Values are
+        # truncated to integers first like edge_profile.
+        lines = np.ascontiguousarray(lines)
+        values = lines.astype(np.int16)
+        gradients = np.empty_like(values)
+        np.subtract(values[:, :-step], values[:, step:], out=gradients[:, step:])
+        np.subtract(values[:, -step:], values[:, :step], out=gradients[:, :step])
+        rising = gradients > threshhold
+        falling = gradients < -threshhold
+
+        # Per lattice: (samples per line, rising index, falling index, minimum
+        # table, minimum table without the falling edges)
+        if np.issubdtype(lines.dtype, np.integer):
+            excluded = np.iinfo(lines.dtype).max
+        else:
+            excluded = np.inf
+        self.__lattices = []
+        for first in range(step):
+            samples = np.ascontiguousarray(lines[:, first::step])
+            lattice_falling = np.ascontiguousarray(falling[:, first::step])
+            self.__lattices.append((samples.shape[1], edge_index(np.ascontiguousarray(rising[:, first::step])),
+                                    edge_index(lattice_falling), minimum_table(samples),
+                                    minimum_table(np.where(lattice_falling, excluded, samples))))
+
+    def __next(self, index, line, position, forward):
+        # Position of the first edge at or after (forward) or at or before
+        # position on its lattice of the line, or None
+        samples = self.__lattices[position % self.step][0]
+        before, positions = index
+        flat = line * samples + position // self.step
+        edge = before[flat] if forward else before[flat + 1] - 1
+        if edge < 0 or edge >= len(positions):
+            return None
+        flat = positions[edge]
+        if flat // samples != line:
+            return None
+        return position % self.step + int(flat % samples) * self.step
+
+    def next_rising(self, line, position):
+        return self.__next(self.__lattices[position % self.step][1], line, position, True)
+
+    def previous_rising(self, line, position):
+        return self.__next(self.__lattices[position % self.step][1], line, position, False)
+
+    def next_falling(self, line, position):
+        return self.__next(self.__lattices[position % self.step][2], line, position, True)
+
+    def previous_falling(self, line, position):
+        return self.__next(self.__lattices[position % self.step][2], line, position, False)
+
+    def minimum(self, line, start, stop, skip_falling=False):
+        # Minimum pixel of line[start:stop:step], leaving out the falling edges
+        # if skip_falling. stop has to be past start.
+        lattice = self.__lattices[start % self.step]
+        table = lattice[4] if skip_falling else lattice[3]
+        first = start // self.step
+        count = (stop - 1 - start) // self.step + 1
+        level = count.bit_length() - 1
+        return min(table[level][line, first], table[level][line, first + count - (1 << level)]).item()
+
+    def trace(self, line, start, stop, track_from_start):
+        # trace_edges of the edge_profile of line[start:stop:step], from lookups
+        if start >= stop:
+            return False, None, None, None, 255
+        step = self.step
+        last = start + (stop - 1 - start) // step * step
+
+        rising = self.next_rising(line, start)
+        if rising is not None and rising > last:
+            rising = None
+        falling = self.next_falling(line, start)
+        cross_encounter = rising is not None or (falling is not None and falling <= last)
+
+        first_falling = None
+        last_falling = None
+        if rising is None:
+            minimum = self.minimum(line, start, stop) if track_from_start else 255
+            return cross_encounter, None, None, None, min(255, minimum)
+
+        if rising < last:
+            falling = self.next_falling(line, rising + step)
+            if falling is not None and falling <= last:
+                first_falling = (falling - start) // step
+                last_falling = (self.previous_falling(line, last) - start) // step
+
+        # The falling edges after the first rising edge are not counted, and
+        # neither is anything before it unless tracking from the start
+        minimum = self.minimum(line, start if track_from_start else rising, rising + 1)
+        if rising < last:
+            minimum = min(minimum, self.minimum(line, rising + step, stop, True))
+        return cross_encounter, (rising - start) // step, first_falling, last_falling, min(255, minimum)
+
+
+def edge_index(edges):
+    # (count of the edges before every flat position, one more position at the
+    # end, and the flat positions of the edges) of a lattice flattened line
+    # after line
+    positions = np.flatnonzero(edges)
+    runs = np.diff(np.concatenate(([0], positions + 1, [edges.size + 1])))
+    return np.repeat(np.arange(len(positions) + 1, dtype=np.int32), runs), positions
+
+
+def minimum_table(samples):
+    # Sparse table of the minimum of every run of 2 ** level samples along the
+    # lines, for constant time range minimum queries
+    table = [samples]
+    width = 1
+    while 2 * width <= samples.shape[1]:
+        previous = table[-1]
+        table.append(np.minimum(previous[:, :-width], previous[:, width:]))
+        width *= 2
+    return table
+
+
+class FrameMaps:
+    # Precomputation of one frame for the given gradient threshhold, shared by
+    # the scan, the target updates and every pinpoint of the frame
+    def __init__(self, image, threshhold):
+        self.image = image
+        self.threshhold = threshhold
+        self.__rows = {}
+        self.__columns = {}
+
+    def rows(self, step):
+        # LineMaps of the image rows sampled every step columns
+        maps = self.__rows.get(step)
+        if maps is None:
+            maps = self.__rows[step] = LineMaps(self.image, step, self.threshhold)
+        return maps
+
+    def columns(self, step):
+        # LineMaps of the image columns sampled every step rows
+        maps = self.__columns.get(step)
+        if maps is None:
+            maps = self.__columns[step] = LineMaps(self.image.T, step, self.threshhold)
+        return maps
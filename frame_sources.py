@@ -0,0 +1,161 @@
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+import frame_buffers
+
+# Frame sources for the tracking loop. Every source yields (timestamp, frame)
+# pairs, so the loop can run on the PiCamera, on recorded images or videos, or on
+# synthetic frames. The format attribute of a source tells whether frames are
+# (height, width, 3) uint8 RGB arrays or padded YUV420 arrays (see frame_buffers).
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class PiCameraSource:
+    def __init__(self, resolution, framerate, frame_format="rgb"):
+        # Imported here so the other sources work on machines without a PiCamera
+        from picamera import PiCamera
+        from picamera.array import PiRGBArray
+
+        self.format = frame_format
+        self.__camera = PiCamera()
+        self.__camera.resolution = tuple(resolution)
+        self.__camera.framerate = framerate
+        if frame_format == "yuv":
+            # Capture straight into one preallocated buffer, the luma plane of
+            # which is the grayscale frame
+            self.__capture = frame_buffers.yuv_buffer(resolution)
+        else:
+            self.__capture = PiRGBArray(self.__camera, size=tuple(resolution))
+
+    def frames(self):
+        if self.format == "yuv":
+            for _ in self.__camera.capture_continuous(self.__capture, format="yuv", use_video_port=True):
+                yield time.time(), self.__capture
+            return
+
+        for frame in self.__camera.capture_continuous(self.__capture, format="rgb", use_video_port=True):
+            yield time.time(), frame.array
+            self.__capture.truncate(0)
+
+
+class ImageDirectorySource:
+    format = "rgb"
+
+    def __init__(self, path, resolution=None, loops=1):
+        # Replay every image of a directory in name order, optionally resized to
+        # the camera resolution and repeated a number of times
+        self.__paths = sorted(p for p in glob.glob(os.path.join(path, "*"))
+                              if p.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.__paths:
+            raise IOError("No images found in %s" % path)
+
+        self.__resolution = resolution
+        self.__loops = loops
+
+        # Decode once so replay speed is not limited by JPEG decoding
+        self.__images = [self.__load(p) for p in self.__paths]
+
+    def __load(self, path):
+        bgr = cv2.imread(path)
+        if bgr is None:
+            raise IOError("Could not read image: %s" % path)
+        if self.__resolution and (bgr.shape[1], bgr.shape[0]) != tuple(self.__resolution):
+            bgr = cv2.resize(bgr, tuple(self.__resolution), interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(bgr[:, :, ::-1])
+
+    def frames(self):
+        for _ in range(self.__loops):
+            for image in self.__images:
+                # Hand out a copy since the loop draws on the frames it gets
+                yield time.time(), image.copy()
+
+
+class VideoSource:
+    format = "rgb"
+
+    def __init__(self, path, resolution=None):
+        self.__path = path
+        self.__resolution = resolution
+
+    def frames(self):
+        capture = cv2.VideoCapture(self.__path)
+        if not capture.isOpened():
+            raise IOError("Could not open video: %s" % self.__path)
+
+        try:
+            while True:
+                ok, bgr = capture.read()
+                if not ok:
+                    break
+                if self.__resolution and (bgr.shape[1], bgr.shape[0]) != tuple(self.__resolution):
+                    bgr = cv2.resize(bgr, tuple(self.__resolution), interpolation=cv2.INTER_AREA)
+                yield time.time(), np.ascontiguousarray(bgr[:, :, ::-1])
+        finally:
+            capture.release()
+
+
+class SyntheticSource:
+    format = "rgb"
+
+    def __init__(self, resolution, count=300, crosses=2, noise=8, seed=0):
+        # Dark crosses drifting over a bright floor, with sensor noise
+        self.__resolution = resolution
+        self.__count = count
+        self.__crosses = crosses
+        self.__noise = noise
+        self.__seed = seed
+
+    def frames(self):
+        width, height = self.__resolution
+        random = np.random.RandomState(self.__seed)
+
+        # Each cross drifts inside its own column lane so crosses never overlap.
+        # Every cross has a center, velocity and arm length.
+        lane = width / self.__crosses
+        arms = np.minimum(random.uniform(0.08, 0.15, self.__crosses) * height, lane / 2 - 15)
+        low = np.stack([arms + 15, np.arange(self.__crosses) * lane + arms + 15], axis=1)
+        high = np.stack([height - arms - 15, (np.arange(self.__crosses) + 1) * lane - arms - 15], axis=1)
+        centers = random.uniform(low, high)
+        velocities = random.uniform(-3, 3, (self.__crosses, 2))
+        floor = np.full((height, width, 3), 200, dtype=np.uint8)
+
+        for i in range(self.__count):
+            image = floor.copy()
+            for center, arm in zip(centers, arms):
+                bar = max(int(arm / 3), 2)
+                row, col, arm = int(center[0]), int(center[1]), int(arm)
+                image[row - arm:row + arm, col - bar // 2:col + bar // 2] = 30
+                image[row - bar // 2:row + bar // 2, col - arm:col + arm] = 30
+
+            if self.__noise:
+                image = cv2.add(image, random.randint(0, self.__noise, image.shape).astype(np.uint8))
+
+            yield time.time(), image
+
+            # Bounce the crosses off the edges of their lanes
+            centers += velocities
+            out = (centers < low) | (centers > high)
+            velocities[out] *= -1
+            centers = np.clip(centers, low, high)
+
+
+def open_source(spec, resolution, framerate):
+    # Create a frame source from a command line specification: "camera",
+    # "camera-yuv", "synthetic[:frames]", a directory of images or a video file
+    if spec == "camera":
+        return PiCameraSource(resolution, framerate)
+    if spec == "camera-yuv":
+        return PiCameraSource(resolution, framerate, "yuv")
+    if spec.startswith("synthetic"):
+        count = int(spec.split(":")[1]) if ":" in spec else 300
+        return SyntheticSource(resolution, count)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, resolution)
+    if os.path.isfile(spec):
+        return VideoSource(spec, resolution)
+    raise ValueError("Unknown frame source: %s" % spec)
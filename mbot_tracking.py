@@ -1,81 +1,305 @@
-import numpy as np
-from picamera import PiCamera
-from picamera.array import PiRGBArray
-import pygame
+import argparse
+import threading
 import time
-import sys
 import cv2
 import tracker
-import lcm
+import tracker_stats
+from controller import ControlLoop, FollowController
+from frame_buffers import FrameBuffers
+from frame_sources import open_source
+from pipeline import LatestQueue, Stage
+from publishers import open_publisher
 from lcmtypes.simple_motor_command_t import simple_motor_command_t
 
-tracker = tracker.Tracker((4,4), 5, 35, 20, 15)
 camera_resolution = [640,480]
 camera_framerate = 15
 scan_period = 50
 update_period = 1
 dot_size = 4
+report_period = 100
 
 FORWARD_VEL_CONST = 0.3
 ANGULAR_VEL_CONST = 0.15
 
-lc = lcm.LCM("udpm://239.255.76.67:7667?ttl=1")
-pygame.init()
-pygame.display.set_caption("Tracking Feed")
-screen = pygame.display.set_mode(camera_resolution)
-camera = PiCamera()
-camera.resolution = tuple(camera_resolution)
-camera.framerate = camera_framerate
-rawCapture = PiRGBArray(camera, size=tuple(camera_resolution))
-
-frame_counter = 0
-
-for frame in camera.capture_continuous(rawCapture, format="rgb", use_video_port=True):
-    image = frame.array
-
-    gray = image.mean(2)
-    if frame_counter % scan_period == 0:
-        tracker.scan(gray, (20,20,20,20))
-        image = cv2.putText(image, 'Scan', (20,30), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0,255,0))
-    elif frame_counter % update_period == 0 and len(tracker.get_target_centers()) > 0:
-        image = cv2.putText(image, 'Track...', (20,30), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0,0,255))
-        tracker.update_targets(gray)
-
-    for center in tracker.get_target_centers():
-        image = cv2.circle(image, (center[1], center[0]), dot_size, (255,0,0), -1)
-
-    screen.fill([0,0,0])
-    image = image.swapaxes(0,1)
-    image = pygame.surfarray.make_surface(image)
-    screen.blit(image, (0,0))
-    pygame.display.update()
 
+class Display:
+    def __init__(self, resolution):
+        # Imported here so headless runs do not need pygame
+        import pygame
+        self.__pygame = pygame
+        pygame.init()
+        pygame.display.set_caption("Tracking Feed")
+        self.__screen = pygame.display.set_mode(resolution)
+
+    def show(self, image):
+        # Copy the frame straight into the screen surface instead of creating a
+        # new surface every frame
+        self.__pygame.surfarray.blit_array(self.__screen, image.swapaxes(0,1))
+        self.__pygame.display.update()
+
+    def read_keys(self, command):
+        # Apply the arrow keys to the command. Returns False when the user quits.
+        pygame = self.__pygame
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+
+        key_input = pygame.key.get_pressed()
+        if key_input[pygame.K_LEFT]:
+            command.angular_velocity += ANGULAR_VEL_CONST
+        if key_input[pygame.K_UP]:
+            command.forward_velocity += FORWARD_VEL_CONST
+        if key_input[pygame.K_RIGHT]:
+            command.angular_velocity -= ANGULAR_VEL_CONST
+        if key_input[pygame.K_DOWN]:
+            command.forward_velocity -= FORWARD_VEL_CONST
+        if key_input[pygame.K_q]:
+            return False
+
+        return True
+
+    def close(self):
+        self.__pygame.quit()
+        cv2.destroyAllWindows()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Track crosses in the camera feed and drive the MBot")
+    parser.add_argument("--source", default="camera",
+                        help='"camera", "camera-yuv", "synthetic[:frames]", a directory of images or a video file')
+    parser.add_argument("--publisher", default="lcm", help='"lcm", "null" or "file:PATH"')
+    parser.add_argument("--headless", action="store_true", help="run without the pygame display")
+    parser.add_argument("--max-frames", type=int, default=0, help="stop after this many frames")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run capture, tracking, display and publishing on separate threads")
+    parser.add_argument("--backend", default="python", choices=("python", "numba"), help="tracker backend")
+    parser.add_argument("--workers", type=int, default=0, help="workers to update tracked targets concurrently")
+    parser.add_argument("--pool", default="thread", choices=("thread", "process"), help="kind of worker pool")
+    parser.add_argument("--scan-divisions", type=int, default=0,
+                        help="scan 1/N of the image every frame instead of a full scan every scan_period frames")
+    parser.add_argument("--change-threshhold", type=int, default=0,
+                        help="mean absolute difference for a block of the frame to count as changed, "
+                             "unchanged blocks are not processed again (0 disables change detection)")
+    parser.add_argument("--cascade", nargs="+", default=[], choices=tuple(tracker_stats.STAGES),
+                        help="cheap tests every scan trigger has to pass, in order, before it is verified")
+    parser.add_argument("--precompute", action="store_true",
+                        help="build the edge and minimum tables of every frame once and share them between "
+                             "all its pinpoints (python backend)")
+    parser.add_argument("--adaptive-threshhold", action="store_true",
+                        help="threshhold every block of the frame from its local contrast, for changing lighting")
+    parser.add_argument("--detector", default="raster", choices=("raster", "template"),
+                        help="trace crosses from the scan grid, or match a template bank that also finds rotated crosses")
+    parser.add_argument("--association", choices=("greedy", "hungarian"),
+                        help="match the detections of all targets in one step per frame, keeping ids stable "
+                             "when crosses pass near each other")
+    parser.add_argument("--follow", action="store_true",
+                        help="drive toward the tracked target instead of following the arrow keys")
+    parser.add_argument("--control-rate", type=float, default=30,
+                        help="rate in Hz of the follow mode commands, independent of the frame rate")
+    parser.add_argument("--stats", action="store_true",
+                        help="instrument the tracker and print its counters with every headless report")
+    return parser.parse_args()
+
+
+def track(target_tracker, gray, frame_counter, incremental=False):
+    # Scan or update the tracker for this frame. Returns the status text and color
+    # to draw, or None.
+    if incremental:
+        target_tracker.incremental_scan(gray, (20,20,20,20))
+        return ('Track...', (0,0,255))
+    elif frame_counter % scan_period == 0:
+        target_tracker.scan(gray, (20,20,20,20))
+        return ('Scan', (0,255,0))
+    elif frame_counter % update_period == 0 and len(target_tracker.get_target_centers()) > 0:
+        target_tracker.update_targets(gray)
+        return ('Track...', (0,0,255))
+    return None
+
+
+def draw(image, status, centers):
+    # Draw the status and target centers on the image in place
+    if status:
+        cv2.putText(image, status[0], (20,30), cv2.FONT_HERSHEY_SIMPLEX, 0.75, status[1])
+    for center in centers:
+        cv2.circle(image, (int(center[1]), int(center[0])), dot_size, (255,0,0), -1)
+    return image
+
+
+def report_stats(target_tracker):
+    # Print the tracker counters of the last report_period frames, if instrumented
+    history = target_tracker.get_stats_history()
+    if history is not None and len(history):
+        print("last %d frames: %s" % (len(history), history.total().summary()))
+
+
+def new_command(forward_velocity=0, angular_velocity=0):
     command = simple_motor_command_t()
     command.utime = int(time.time() * 1000000)
-    command.angular_velocity = 0
-    command.forward_velocity = 0
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-            cv2.destroyAllWindows()
-
-    key_input = pygame.key.get_pressed()
-    if key_input[pygame.K_LEFT]:
-        command.angular_velocity += ANGULAR_VEL_CONST
-    if key_input[pygame.K_UP]:
-        command.forward_velocity += FORWARD_VEL_CONST
-    if key_input[pygame.K_RIGHT]:
-        command.angular_velocity -= ANGULAR_VEL_CONST
-    if key_input[pygame.K_DOWN]:
-        command.forward_velocity -= FORWARD_VEL_CONST
-    if key_input[pygame.K_q]:
-        pygame.quit()
-        sys.exit()
-        cv2.destroyAllWindows()
+    command.angular_velocity = angular_velocity
+    command.forward_velocity = forward_velocity
+    return command
+
+
+def run_serial(args, target_tracker, source, publisher, display, follower=None):
+    # Capture, track, draw and publish one frame after the other. In follow mode
+    # the tracked targets go to the follower, which publishes the commands.
+    buffers = FrameBuffers(camera_resolution)
+    frame_counter = 0
+    start_time = time.time()
+
+    try:
+        for timestamp, image in source.frames():
+            gray = buffers.to_gray(image, source.format)
+            status = track(target_tracker, gray, frame_counter, args.scan_divisions > 0)
+            if follower:
+                follower.observe(timestamp, target_tracker.get_target_array())
+
+            command = new_command()
+
+            if display:
+                rgb = buffers.to_rgb(image, source.format)
+                display.show(draw(rgb, status, target_tracker.get_target_centers()))
+                if not display.read_keys(command):
+                    break
+
+            if not follower:
+                publisher.publish("MBOT_MOTOR_COMMAND_SIMPLE", command.encode())
+
+            frame_counter += 1
+            if args.headless and frame_counter % report_period == 0:
+                print("%d frames, %.1f fps" % (frame_counter, frame_counter / (time.time() - start_time)))
+                report_stats(target_tracker)
+            if args.max_frames and frame_counter >= args.max_frames:
+                break
+
+    finally:
+        elapsed = time.time() - start_time
+        if frame_counter:
+            print("Processed %d frames in %.2f s (%.1f fps)" % (frame_counter, elapsed, frame_counter / elapsed))
+
+
+def run_pipelined(args, target_tracker, source, publisher, display, follower=None):
+    # Capture, tracking and publishing each run on their own thread, connected by
+    # single slot queues that drop stale frames. The display stays on the main
+    # thread because pygame has to be driven from there. In follow mode the
+    # follower publishes instead of the publish stage.
+    tracking_queue = LatestQueue()
+    display_queue = LatestQueue()
+    publish_queue = LatestQueue()
+    tracking_buffers = FrameBuffers(camera_resolution)
+    display_buffers = FrameBuffers(camera_resolution)
+
+    # Latest (forward, angular) velocity from the keyboard
+    key_command = [0, 0]
+    frame_counter = [0]
+    done = threading.Event()
+
+    def capture(item):
+        # YUV captures reuse one buffer, so they are copied before being handed on
+        timestamp, image = item
+        return (timestamp, image.copy() if source.format == "yuv" else image)
+
+    def track_frame(item):
+        timestamp, image = item
+        gray = tracking_buffers.to_gray(image, source.format)
+        status = track(target_tracker, gray, frame_counter[0], args.scan_divisions > 0)
+        if follower:
+            follower.observe(timestamp, target_tracker.get_target_array())
+        frame_counter[0] += 1
+        if args.max_frames and frame_counter[0] >= args.max_frames:
+            done.set()
+        return (timestamp, image, status, target_tracker.get_target_centers().copy())
+
+    def publish(item):
+        command = new_command(*key_command)
+        publisher.publish("MBOT_MOTOR_COMMAND_SIMPLE", command.encode())
+
+    outputs = (() if follower else (publish_queue,)) + ((display_queue,) if display else ())
+    stages = [
+        Stage("capture", capture, output_queues=(tracking_queue,), source=source.frames()),
+        Stage("track", track_frame, tracking_queue, outputs),
+    ]
+    if not follower:
+        stages.append(Stage("publish", publish, publish_queue))
+
+    start_time = time.time()
+    for stage in stages:
+        stage.start()
+
+    try:
+        while not done.is_set() and not any(stage.stopped.is_set() for stage in stages):
+            if not display:
+                done.wait(1)
+                if args.headless and frame_counter[0]:
+                    print("%d frames, %.1f fps" % (frame_counter[0], frame_counter[0] / (time.time() - start_time)))
+                    report_stats(target_tracker)
+                continue
+
+            item = display_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            timestamp, image, status, centers = item
+            display.show(draw(display_buffers.to_rgb(image, source.format), status, centers))
+
+            command = new_command()
+            if not display.read_keys(command):
+                break
+            key_command[:] = [command.forward_velocity, command.angular_velocity]
+
+    finally:
+        for stage in stages:
+            stage.stop()
+        for stage in stages:
+            stage.join()
+
+        elapsed = time.time() - start_time
+        if frame_counter[0]:
+            print("Processed %d frames in %.2f s (%.1f fps)" % (frame_counter[0], elapsed, frame_counter[0] / elapsed))
+        for stage in stages:
+            print(stage.stats.summary())
+            if stage.error:
+                print("%s stage failed: %r" % (stage.name, stage.error))
+        print("dropped frames: tracking %d, display %d, publish %d" % (
+            tracking_queue.dropped, display_queue.dropped, publish_queue.dropped))
+
+
+def main():
+    args = parse_args()
+
+    target_tracker = tracker.Tracker((4,4), 5, 35, 20, 15, backend=args.backend, workers=args.workers, pool=args.pool,
+                                     scan_divisions=max(args.scan_divisions, 1),
+                                     change_threshhold=args.change_threshhold, cascade=args.cascade,
+                                     precompute=args.precompute, adaptive_threshhold=args.adaptive_threshhold,
+                                     detector=args.detector, association=args.association, stats=args.stats,
+                                     stats_history=report_period)
+    source = open_source(args.source, camera_resolution, camera_framerate)
+    publisher = open_publisher(args.publisher)
+    display = None if args.headless else Display(camera_resolution)
+
+    # In follow mode commands come from the control thread at its own rate
+    follower = None
+    if args.follow:
+        follower = ControlLoop(FollowController(camera_resolution), publisher, args.control_rate)
+        follower.start()
+
+    try:
+        if args.pipeline:
+            run_pipelined(args, target_tracker, source, publisher, display, follower)
+        else:
+            run_serial(args, target_tracker, source, publisher, display, follower)
+
+    finally:
+        if follower:
+            follower.stop()
+            follower.join()
+            print("control: %d commands published" % follower.count)
+            if follower.error:
+                print("control loop failed: %r" % follower.error)
+        target_tracker.close()
+        publisher.close()
+        if display:
+            display.close()
 
-    lc.publish("MBOT_MOTOR_COMMAND_SIMPLE", command.encode())
 
-    rawCapture.truncate(0)
-    frame_counter += 1
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Threaded pipeline stages connected by bounded queues. Queues drop the oldest
+# item when they are full, so a slow stage always works on the newest frame
+# instead of falling further and further behind.
+
+
+class LatestQueue:
+    def __init__(self, maxsize=1):
+        self.__queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        # Replace the oldest item instead of blocking when the queue is full
+        while True:
+            try:
+                self.__queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.__queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        # Returns None on timeout
+        try:
+            return self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class StageStats:
+    def __init__(self, name, history=200):
+        # Latency of the most recent items in seconds
+        self.name = name
+        self.count = 0
+        self.latencies = collections.deque(maxlen=history)
+        self.__lock = threading.Lock()
+
+    def record(self, latency):
+        with self.__lock:
+            self.count += 1
+            self.latencies.append(latency)
+
+    def summary(self):
+        with self.__lock:
+            latencies = np.array(self.latencies) * 1000
+        if not len(latencies):
+            return "%s: no items" % self.name
+        return "%s: %d items, p50 %.1f ms, p90 %.1f ms, max %.1f ms" % (
+            self.name, self.count, np.percentile(latencies, 50), np.percentile(latencies, 90), latencies.max())
+
+
+class Stage(threading.Thread):
+    # Pull items from an input queue, process them and push the results to the
+    # output queues. A source stage has no input queue and pulls from an iterator
+    # instead. Processing returns None to drop an item.
+
+    def __init__(self, name, process, input_queue=None, output_queues=(), source=None):
+        super().__init__(name=name, daemon=True)
+        self.stats = StageStats(name)
+        self.stopped = threading.Event()
+        self.error = None
+        self.__process = process
+        self.__input = input_queue
+        self.__outputs = output_queues
+        self.__source = source
+
+    def __items(self):
+        if self.__source is not None:
+            for item in self.__source:
+                if self.stopped.is_set():
+                    return
+                yield item
+            return
+
+        while not self.stopped.is_set():
+            item = self.__input.get(timeout=0.1)
+            if item is not None:
+                yield item
+
+    def run(self):
+        try:
+            for item in self.__items():
+                start = time.perf_counter()
+                result = self.__process(item)
+                self.stats.record(time.perf_counter() - start)
+                if result is not None:
+                    for output in self.__outputs:
+                        output.put(result)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopped.set()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,72 @@
+import struct
+import time
+
+# Command publishers for the tracking loop. The robot publishes on the LCM bus;
+# offline runs either drop the messages or log them to a file for inspection.
+
+LCM_URL = "udpm://239.255.76.67:7667?ttl=1"
+
+
+class LcmPublisher:
+    def __init__(self, url=LCM_URL):
+        # Imported here so offline runs do not need LCM installed
+        import lcm
+        self.__lc = lcm.LCM(url)
+
+    def publish(self, channel, data):
+        self.__lc.publish(channel, data)
+
+    def close(self):
+        pass
+
+
+class NullPublisher:
+    def __init__(self):
+        self.count = 0
+
+    def publish(self, channel, data):
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+class FilePublisher:
+    # Every message is stored as a record of
+    # (utime: int64, channel length: int32, data length: int32, channel, data)
+    RECORD_HEADER = struct.Struct(">qii")
+
+    def __init__(self, path):
+        self.__file = open(path, "wb")
+
+    def publish(self, channel, data):
+        channel = channel.encode()
+        self.__file.write(self.RECORD_HEADER.pack(int(time.time() * 1000000), len(channel), len(data)))
+        self.__file.write(channel)
+        self.__file.write(data)
+
+    def close(self):
+        self.__file.close()
+
+
+def read_log(path):
+    # Iterate over the (utime, channel, data) records written by FilePublisher
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(FilePublisher.RECORD_HEADER.size)
+            if len(header) < FilePublisher.RECORD_HEADER.size:
+                break
+            utime, channel_length, data_length = FilePublisher.RECORD_HEADER.unpack(header)
+            yield utime, f.read(channel_length).decode(), f.read(data_length)
+
+
+def open_publisher(spec):
+    # Create a publisher from a command line specification: "lcm", "null" or
+    # "file:PATH"
+    if spec == "lcm":
+        return LcmPublisher()
+    if spec == "null":
+        return NullPublisher()
+    if spec.startswith("file:"):
+        return FilePublisher(spec[len("file:"):])
+    raise ValueError("Unknown publisher: %s" % spec)
@@ -0,0 +1,260 @@
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+import tracker
+from benchmark import DEFAULT_PARAMS, REPO_DIR, BORDER, git_revision, parse_pair, resize
+
+# Parameter sweep for the tracker constants. Every parameter set is run over a
+# set of clips (a still image repeated for a number of frames, or a segment of a
+# recorded .npy frame stack) the way the camera loop runs it, on all cores. The
+# detections are compared with those of a reference parameter set to get a
+# detection rate, and the Pareto front of detection rate against per frame
+# latency is reported. Results are cached per (clip, parameters, scan period,
+# border, code revision) so a rerun only runs the new combinations, and results
+# of older code are never reused.
+
+SWEPT = ("scan_offset", "target_offset", "threshhold", "tracking_offset", "tracking_timeout")
+
+# Thorough settings the detections of every parameter set are compared against
+REFERENCE_PARAMS = dict(DEFAULT_PARAMS, scan_offset=(2, 2))
+
+# Clips loaded by this process, by spec
+_clips = {}
+
+
+def load_clip(spec):
+    # Frames of a clip spec: ("image", path, frames, resolution) or
+    # ("stack", path, start, stop)
+    clip = _clips.get(spec)
+    if clip is None:
+        if spec[0] == "image":
+            _, path, frames, resolution = spec
+            bgr = cv2.imread(path)
+            if bgr is None:
+                raise IOError("Could not read image: %s" % path)
+            image = resize(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY), resolution)
+            clip = np.repeat(image[None], frames, axis=0)
+        else:
+            _, path, start, stop = spec
+            clip = np.asarray(np.load(path, mmap_mode="r")[start:stop])
+        _clips[spec] = clip
+    return clip
+
+
+def clip_specs(paths, frames, resolution, segment_length):
+    # Split the inputs into clips: every image is one clip and every frame
+    # stack is cut into segments
+    specs = []
+    for path in paths:
+        if path.endswith(".npy"):
+            count = len(np.load(path, mmap_mode="r"))
+            specs.extend(("stack", path, start, min(start + segment_length, count))
+                         for start in range(0, count, segment_length))
+        else:
+            specs.append(("image", path, frames, tuple(resolution)))
+    return specs
+
+
+def code_revision():
+    # Git revision of the code, with a hash of the uncommitted changes when the
+    # tree is dirty, or None outside of a git checkout
+    revision = git_revision()
+    if revision is None:
+        return None
+    try:
+        diff = subprocess.check_output(["git", "diff", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return revision
+    return revision + ("+" + hashlib.sha1(diff).hexdigest()[:12] if diff else "")
+
+
+def cache_key(clip_hash, params, scan_period, revision):
+    # Results depend on the clip, every tracker setting and the code
+    return clip_hash + ":" + json.dumps({"params": params_json(params), "scan_period": scan_period,
+                                         "border": list(BORDER), "revision": revision}, sort_keys=True)
+
+
+def params_json(params):
+    return dict(params, scan_offset=list(params["scan_offset"]))
+
+
+def run_job(spec, params, scan_period):
+    # Track one clip with one parameter set. Returns the latency of every frame
+    # in seconds and the (row, col, radius) of the targets after every frame.
+    clip = load_clip(spec)
+    clip_tracker = tracker.Tracker(params["scan_offset"], params["target_offset"], params["threshhold"],
+                                   params["tracking_offset"], params["tracking_timeout"])
+    latencies = []
+    targets = []
+    for frame_counter, image in enumerate(clip):
+        start = time.perf_counter()
+        clip_tracker.track_frame(image, frame_counter, BORDER, scan_period)
+        latencies.append(time.perf_counter() - start)
+        targets.append(clip_tracker.get_target_array()[:, 1:].tolist())
+    return {"latencies": latencies, "targets": targets}
+
+
+def detection_rate(results, reference):
+    # Fraction of the reference targets, over all frames, that have a detected
+    # target within half their radius, and the number of detections that match no
+    # reference target
+    matched = 0
+    total = 0
+    false_positives = 0
+    for frame_targets, frame_reference in zip(results, reference):
+        found = np.array(frame_targets, dtype=float).reshape(-1, 3)
+        expected = np.array(frame_reference, dtype=float).reshape(-1, 3)
+        total += len(expected)
+        if not len(found) or not len(expected):
+            false_positives += len(found)
+            continue
+
+        distances = np.hypot(found[:, None, 0] - expected[None, :, 0], found[:, None, 1] - expected[None, :, 1])
+        close = distances <= expected[None, :, 2] / 2
+        matched += int(close.any(axis=0).sum())
+        false_positives += int((~close.any(axis=1)).sum())
+
+    return (matched / total if total else 1.0), false_positives
+
+
+def pareto_front(summaries):
+    # Parameter sets no other set beats on both latency and detection rate
+    front = []
+    for summary in summaries:
+        dominated = any(other["latency_ms"] <= summary["latency_ms"] and
+                        other["detection_rate"] >= summary["detection_rate"] and
+                        (other["latency_ms"] < summary["latency_ms"] or
+                         other["detection_rate"] > summary["detection_rate"])
+                        for other in summaries)
+        if not dominated:
+            front.append(summary)
+    return sorted(front, key=lambda s: s["latency_ms"])
+
+
+def parameter_sets(args):
+    # Every combination of the swept values, or a random sample of them
+    values = [args.scan_offset, args.target_offset, args.threshhold, args.tracking_offset, args.tracking_timeout]
+    grid = [dict(zip(SWEPT, combination)) for combination in itertools.product(*values)]
+    if args.random and args.random < len(grid):
+        grid = random.Random(args.seed).sample(grid, args.random)
+    return grid
+
+
+def load_cache(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the tracker parameters for detection rate against latency")
+    parser.add_argument("inputs", nargs="*", help="images or .npy frame stacks (default: all JPGs in the repo)")
+    parser.add_argument("--scan-offset", nargs="+", type=parse_pair, default=[(2, 2), (4, 4), (6, 6), (8, 8)],
+                        help="scan offsets as row,col")
+    parser.add_argument("--target-offset", nargs="+", type=int, default=[3, 5, 8])
+    parser.add_argument("--threshhold", nargs="+", type=int, default=[25, 35, 45])
+    parser.add_argument("--tracking-offset", nargs="+", type=int, default=[10, 20])
+    parser.add_argument("--tracking-timeout", nargs="+", type=int, default=[15])
+    parser.add_argument("--random", type=int, default=0, help="run this many random combinations instead of all")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random search")
+    parser.add_argument("--resolution", type=parse_pair, default=(640, 480), help="image resolution as WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=10, help="frames every still image is tracked for")
+    parser.add_argument("--segment-length", type=int, default=100, help="frames per clip of a frame stack")
+    parser.add_argument("--scan-period", type=int, default=50, help="frames between full scans")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: one per core)")
+    parser.add_argument("--cache", default="sweep_cache.json", help="results cache, empty to disable")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="drop every cached result, such as those of older code, before running")
+    parser.add_argument("--output", default="sweep_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    paths = args.inputs or sorted(glob.glob(os.path.join(REPO_DIR, "*.jpg")))
+    specs = clip_specs(paths, args.frames, args.resolution, args.segment_length)
+    clip_hashes = {spec: hashlib.sha1(np.ascontiguousarray(load_clip(spec)).tobytes()).hexdigest()
+                   for spec in specs}
+    _clips.clear()
+
+    parameters = parameter_sets(args)
+    cache = {} if args.clear_cache else load_cache(args.cache)
+    revision = code_revision()
+
+    def key(spec, params):
+        return cache_key(clip_hashes[spec], params, args.scan_period, revision)
+
+    # Run every (clip, parameters) that is not cached yet, the reference included
+    jobs = [(spec, params) for params in [REFERENCE_PARAMS] + parameters for spec in specs
+            if key(spec, params) not in cache]
+    print("%d parameter sets x %d clips, %d to run" % (len(parameters), len(specs), len(jobs)))
+    with concurrent.futures.ProcessPoolExecutor(args.workers or None) as executor:
+        futures = {executor.submit(run_job, spec, params, args.scan_period): (spec, params) for spec, params in jobs}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            spec, params = futures[future]
+            cache[key(spec, params)] = future.result()
+            if done % 50 == 0:
+                print("%d/%d" % (done, len(jobs)))
+
+    if args.cache:
+        with open(args.cache, "w") as f:
+            json.dump(cache, f)
+
+    summaries = []
+    for params in parameters:
+        latencies = []
+        matched = 0.0
+        expected = 0
+        false_positives = 0
+        for spec in specs:
+            result = cache[key(spec, params)]
+            reference = cache[key(spec, REFERENCE_PARAMS)]["targets"]
+            rate, clip_false_positives = detection_rate(result["targets"], reference)
+            clip_expected = sum(map(len, reference))
+            matched += rate * clip_expected
+            expected += clip_expected
+            false_positives += clip_false_positives
+            latencies.extend(result["latencies"])
+
+        latencies = np.array(latencies) * 1000
+        summaries.append({
+            "params": params_json(params),
+            "detection_rate": matched / expected if expected else 1.0,
+            "false_positives": false_positives,
+            "latency_ms": float(latencies.mean()),
+            "p99_ms": float(np.percentile(latencies, 99)),
+        })
+
+    front = pareto_front(summaries)
+    print("Pareto front of detection rate against mean latency per frame:")
+    for summary in front:
+        params = summary["params"]
+        print("  %6.2f ms  %5.1f%% detected  %3d false  scan_offset=%s target_offset=%d threshhold=%d "
+              "tracking_offset=%d tracking_timeout=%d" % (
+                  summary["latency_ms"], summary["detection_rate"] * 100, summary["false_positives"],
+                  tuple(params["scan_offset"]), params["target_offset"], params["threshhold"],
+                  params["tracking_offset"], params["tracking_timeout"]))
+
+    results = {
+        "revision": revision,
+        "timestamp": time.time(),
+        "reference": params_json(REFERENCE_PARAMS),
+        "clips": [list(spec) for spec in specs],
+        "summaries": sorted(summaries, key=lambda s: s["latency_ms"]),
+        "pareto_front": front,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
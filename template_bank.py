@@ -0,0 +1,217 @@
+import math
+
+import numpy as np
+
+# Cross detection by matching a bank of cross templates over scale, rotation
+# and bar width against a decimated frame. Every template is correlated with
+# the frame through the FFT, normalized by the local contrast of the frame, so
+# the score of a position is the normalized cross-correlation of its
+# neighbourhood with the best template, between -1 and 1. Unlike the raster
+# scan this does not depend on the bars being aligned with the image axes.
+#
+# The templates are matched at several decimations half an octave apart, so
+# the same templates also cover crosses filling the frame, at a fraction of the
+# cost of larger templates. Every size of cross is then matched at two or three
+# decimations, which also makes the score depend much less on where the block
+# grid falls on the cross. The spectra of the templates only depend on the
+# size of the (padded) decimated region, and are cached per size.
+
+
+class TemplateBank:
+    def __init__(self, radii=(3, 4, 5, 6, 8, 10, 13), angles=(0, 15, 30, 45, 60, 75), widths=(0.15, 0.4),
+                 decimation=4, levels=7, score=0.8, min_contrast=8, cache_size=16):
+        # radii are the arm lengths of the templates in decimated pixels, angles
+        # their rotations in degrees (crosses repeat every 90 degrees) and
+        # widths the bar width as a fraction of the arm length. The frame is
+        # decimated at levels decimations, the first being decimation and every
+        # further one half an octave above the one before (4, 6, 8, 12, ...). A
+        # detection needs a score of at least score, over a neighbourhood whose
+        # standard deviation is at least min_contrast.
+        self.radii = tuple(radii)
+        self.angles = tuple(angles)
+        self.widths = tuple(widths)
+        self.decimation = decimation
+        self.levels = levels
+        self.score = score
+        self.min_contrast = min_contrast
+        self.cache_size = cache_size
+        self.__templates = {radius: np.stack([cross_template(radius, angle, width) for width in widths
+                                              for angle in angles]) for radius in self.radii}
+        self.__spectra = {}
+
+    def detect(self, image, top=0, bottom=None, left=0, right=None, radius=None):
+        # Crosses centered in image[top:bottom, left:right], best first. Returns
+        # a list of (center_row, center_col, radius) in image pixels. With a
+        # radius, only templates within a factor 1.5 of it are matched.
+        height, width = image.shape[:2]
+        bottom = height if bottom is None else min(bottom, height)
+        right = width if right is None else min(right, width)
+        if top >= bottom or left >= right:
+            return []
+
+        # (decimation, radii) of every level. The search for a known radius only
+        # needs the finest level with templates near it.
+        scales = [(level_decimation(self.decimation, level), self.radii) for level in range(self.levels)]
+        if radius is not None:
+            scales = [(dec, tuple(r for r in radii if radius / 1.5 <= r * dec <= radius * 1.5))
+                      for dec, radii in scales]
+            scales = [scale for scale in scales if scale[1]][:1] or [(self.decimation, self.radii)]
+
+        candidates = []
+        for dec, radii in scales:
+            candidates.extend(self.__candidates(image, top, bottom, left, right, dec, radii))
+
+        # Greedy non-maximum suppression over all levels, best score first
+        detections = []
+        for _, row, col, size in sorted(candidates, key=lambda candidate: -candidate[0]):
+            if any(abs(row - r) <= s and abs(col - c) <= s for r, c, s in detections):
+                continue
+            detections.append((row, col, size))
+        return detections
+
+    def __candidates(self, image, top, bottom, left, right, dec, radii):
+        # (score, center_row, center_col, radius) of the crosses centered in
+        # image[top:bottom, left:right] on the frame decimated by dec, in image
+        # pixels
+        height, width = image.shape[:2]
+
+        # Decimate the region plus a margin of the largest template, aligned to
+        # the decimation grid of the image
+        margin = (max(radii) + 1) * dec
+        crop_top = max(top - margin, 0) // dec * dec
+        crop_left = max(left - margin, 0) // dec * dec
+        decimated = block_mean(image[crop_top:min(bottom + margin, height), crop_left:min(right + margin, width)], dec)
+        if decimated.size == 0:
+            return []
+
+        scores, best_radii = self.__match(decimated, radii)
+
+        # Only centers inside the requested region count
+        first_row = max(-(-(top - crop_top) // dec), 0)
+        first_col = max(-(-(left - crop_left) // dec), 0)
+        scores[:first_row] = -1
+        scores[:, :first_col] = -1
+        scores[-(-(bottom - crop_top) // dec):] = -1
+        scores[:, -(-(right - crop_left) // dec):] = -1
+
+        # Greedy non-maximum suppression, best score first
+        candidates = []
+        cells = []
+        for index in np.argsort(scores, axis=None)[::-1].tolist():
+            if scores.flat[index] < self.score:
+                break
+            row, col = divmod(index, scores.shape[1])
+            if any(abs(row - r) <= s and abs(col - c) <= s for r, c, s in cells):
+                continue
+            cells.append((row, col, int(best_radii[row, col])))
+            candidates.append((float(scores.flat[index]), crop_top + row * dec + dec // 2,
+                               crop_left + col * dec + dec // 2, int(best_radii[row, col]) * dec))
+        return candidates
+
+    def search(self, image, top, bottom, left, right, radius=None):
+        # Best cross centered in the window. Returns (is_found, center_row,
+        # center_col, radius).
+        detections = self.detect(image, top, bottom, left, right, radius)
+        if not detections:
+            return (False, 0, 0, 0)
+        return (True,) + detections[0]
+
+    def __match(self, decimated, radii):
+        # (score, radius) of the best template at every decimated pixel, -1
+        # where no template fits inside the region or the contrast is too low
+        height, width = decimated.shape
+        shape = padded_shape(decimated.shape)
+        spectra = self.__spectra_for(shape)
+        padded = np.zeros(shape)
+        padded[:height, :width] = decimated
+        frame = np.fft.rfft2(padded)
+
+        sums = np.zeros((height + 1, width + 1))
+        squares = np.zeros((height + 1, width + 1))
+        np.cumsum(np.cumsum(decimated, axis=0), axis=1, out=sums[1:, 1:])
+        np.cumsum(np.cumsum(decimated * decimated, axis=0), axis=1, out=squares[1:, 1:])
+
+        scores = np.full((height, width), -1.0)
+        best_radii = np.zeros((height, width), dtype=np.int64)
+        for radius in radii:
+            size = 2 * radius + 1
+            if size > height or size > width:
+                continue
+
+            # Standard deviation of every size x size neighbourhood, and the best
+            # correlation of all the templates of this radius, both indexed by
+            # the top left corner of the neighbourhood
+            count = size * size
+            box = box_sums(sums, size)
+            deviation = np.sqrt(np.maximum(box_sums(squares, size) - box * box / count, 0))
+            correlation = np.fft.irfft2(frame[None] * spectra[radius], s=shape)
+            correlation = correlation.max(axis=0)[:height - size + 1, :width - size + 1]
+
+            valid = deviation > self.min_contrast * math.sqrt(count)
+            score = np.where(valid, correlation / np.where(valid, deviation, 1), -1)
+            inner = scores[radius:height - radius, radius:width - radius]
+            better = score > inner
+            inner[better] = score[better]
+            best_radii[radius:height - radius, radius:width - radius][better] = radius
+        return scores, best_radii
+
+    def __spectra_for(self, shape):
+        # Spectra of the templates of every radius for a padded region of the
+        # given shape, shifted so the correlation lands on the top left corner of
+        # the neighbourhood. Templates larger than the region are left out.
+        spectra = self.__spectra.get(shape)
+        if spectra is None:
+            if len(self.__spectra) >= self.cache_size:
+                self.__spectra.pop(next(iter(self.__spectra)))
+            spectra = {}
+            for radius, templates in self.__templates.items():
+                if templates.shape[1] > shape[0] or templates.shape[2] > shape[1]:
+                    continue
+                kernels = np.zeros((len(templates),) + shape)
+                kernels[:, :templates.shape[1], :templates.shape[2]] = templates[:, ::-1, ::-1]
+                kernels = np.roll(kernels, (-2 * radius, -2 * radius), axis=(1, 2))
+                spectra[radius] = np.fft.rfft2(kernels)
+            self.__spectra[shape] = spectra
+        return spectra
+
+
+def cross_template(radius, angle, width):
+    # Zero mean, unit norm template of a dark cross with arms of radius pixels
+    # rotated by angle degrees, its bars width * radius wide, on a bright
+    # square. Pixels are weighted by how much of them the bars cover.
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1].astype(float)
+    angle = math.radians(angle)
+    along = x * math.cos(angle) + y * math.sin(angle)
+    across = -x * math.sin(angle) + y * math.cos(angle)
+    half = max(width * radius / 2, 0.75)
+    bars = np.maximum(np.clip(half + 0.5 - np.abs(along), 0, 1) * np.clip(radius + 0.5 - np.abs(across), 0, 1),
+                      np.clip(half + 0.5 - np.abs(across), 0, 1) * np.clip(radius + 0.5 - np.abs(along), 0, 1))
+    template = bars.mean() - bars
+    return template / np.linalg.norm(template)
+
+
+def block_mean(image, factor):
+    # Average factor x factor blocks, dropping the rows and columns that do not
+    # fill a whole block
+    height = image.shape[0] // factor * factor
+    width = image.shape[1] // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3))
+
+
+def level_decimation(decimation, level):
+    # Decimation of a level, alternately 3/2 and 4/3 times that of the level
+    # before
+    return (decimation << level // 2) * (3 if level % 2 else 2) // 2
+
+
+def box_sums(table, size):
+    # Sums of every size x size box of the summed-area table (with its leading
+    # row and column of zeros), indexed by the top left corner
+    return table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+
+
+def padded_shape(shape, step=16):
+    # Shape the region is padded to before the FFT, rounded up so windows of
+    # similar sizes share their cached template spectra
+    return tuple(-(-n // step) * step for n in shape)
@@ -0,0 +1,173 @@
+import os
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+import tracker
+import tracker_numba
+from frame_sources import SyntheticSource
+
+# Parity of the tracker backends with the original per pixel implementation on
+# the sample images. The expected values were recorded with the original
+# Tracker((4,4), 5, 35, 20, 15) at the native resolution of every image and
+# the default border: the number of scan triggers, every (trigger_row,
+# trigger_col, center_row, center_col, radius) that pinpoint_target accepts
+# among them, and the (center_row, center_col, radius) targets of a scan.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PARAMS = ((4, 4), 5, 35, 20, 15)
+BORDER = (10, 10, 10, 10)
+
+ORIGINAL = {
+    "image0.jpg": (172, [], []),
+    "image1.jpg": (246, [(234, 362, 253, 362, 21), (238, 362, 253, 362, 21), (242, 362, 255, 362, 21)],
+                   [(253, 362, 21)]),
+    "image2.jpg": (236, [(234, 354, 253, 354, 23), (238, 354, 254, 354, 23), (242, 354, 256, 354, 23),
+                         (246, 354, 258, 354, 23), (250, 354, 260, 354, 23)], [(253, 354, 23)]),
+    "edge_case1.jpg": (724, [(422, 494, 448, 497, 31), (426, 494, 450, 497, 29), (426, 506, 450, 497, 29)],
+                       [(448, 497, 31)]),
+    "edge_case2.jpg": (812, [], []),
+    "edge_case3.jpg": (787, [(650, 626, 694, 636, 55)], [(694, 636, 55)]),
+}
+
+BACKENDS = ["python", pytest.param("numba", marks=pytest.mark.skipif(not tracker_numba.available,
+                                                                       reason="numba is not installed"))]
+
+
+def load_gray(name):
+    return cv2.cvtColor(cv2.imread(os.path.join(REPO_DIR, name)), cv2.COLOR_BGR2GRAY)
+
+
+def target_list(t):
+    return [tuple(target) for target in t.get_target_array()[:, 1:].tolist()]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("name", sorted(ORIGINAL))
+def test_pinpoint_every_trigger(name, backend):
+    image = load_gray(name)
+    count, accepted, _ = ORIGINAL[name]
+    t = tracker.Tracker(*PARAMS, backend=backend)
+
+    rows = np.arange(BORDER[0], image.shape[0] - BORDER[1], PARAMS[0][0])
+    cols = np.arange(BORDER[2], image.shape[1] - BORDER[3], PARAMS[0][1])
+    trigger_rows, trigger_cols = tracker.gradient_triggers(image, rows, cols, PARAMS[0][1], PARAMS[2])
+    assert len(trigger_rows) == count
+
+    found = []
+    for r, c in zip(trigger_rows.tolist(), trigger_cols.tolist()):
+        is_target, center_row, center_col, radius = t.pinpoint_target(image, r, c)
+        if is_target:
+            found.append((r, c, center_row, center_col, radius))
+    assert found == accepted
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("name", sorted(ORIGINAL))
+def test_scan_and_update(name, backend):
+    image = load_gray(name)
+    t = tracker.Tracker(*PARAMS, backend=backend)
+    t.scan(image, BORDER)
+    assert target_list(t) == ORIGINAL[name][2]
+
+    # Tracking the same frame again keeps every target
+    t.update_targets(image)
+    assert len(target_list(t)) == len(ORIGINAL[name][2])
+
+
+@pytest.mark.skipif(not tracker_numba.available, reason="numba is not installed")
+@pytest.mark.parametrize("name", sorted(ORIGINAL))
+def test_backends_agree_over_frames(name):
+    # Both backends go through the same sequence of scans and updates on a
+    # frame moving a few pixels at a time
+    image = load_gray(name)
+    trackers = [tracker.Tracker(*PARAMS, backend=backend) for backend in ("python", "numba")]
+    for frame_counter in range(6):
+        frame = np.roll(image, (2 * frame_counter, 3 * frame_counter), axis=(0, 1))
+        for t in trackers:
+            t.track_frame(frame, frame_counter, BORDER, scan_period=3)
+        assert target_list(trackers[0]) == target_list(trackers[1])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_incremental_scan_never_duplicates(backend):
+    # Probing a tracked cross finds the bounds a scan would find, so the next
+    # slice of the scan never adds the same cross again
+    crosses = 3
+    t = tracker.Tracker(*PARAMS, backend=backend, scan_divisions=4)
+    for _, image in SyntheticSource((640, 480), 300, crosses).frames():
+        t.incremental_scan(cv2.cvtColor(image, cv2.COLOR_RGB2GRAY), (20, 20, 20, 20))
+        assert len(target_list(t)) <= crosses
+
+
+BOUNDSCHECK_SCRIPT = """
+import sys
+import tracker
+import test_tracker
+
+for name in sorted(test_tracker.ORIGINAL):
+    image = test_tracker.load_gray(name)
+    t = tracker.Tracker(*test_tracker.PARAMS, backend="numba")
+    for r, c, _, _, _ in test_tracker.ORIGINAL[name][1]:
+        t.pinpoint_target(image, r, c)
+    t.scan(image, test_tracker.BORDER)
+    assert test_tracker.target_list(t) == test_tracker.ORIGINAL[name][2], name
+    t.update_targets(image)
+    assert len(test_tracker.target_list(t)) == len(test_tracker.ORIGINAL[name][2]), name
+"""
+
+
+@pytest.mark.skipif(not tracker_numba.available, reason="numba is not installed")
+def test_numba_bounds_checked(tmp_path):
+    # The compiled functions never index past their arrays. Bounds checking is
+    # only compiled in when enabled before the first compilation, so this runs
+    # in a new interpreter with its own cache.
+    env = dict(os.environ, NUMBA_BOUNDSCHECK="1", NUMBA_CACHE_DIR=str(tmp_path))
+    result = subprocess.run([sys.executable, "-c", BOUNDSCHECK_SCRIPT], cwd=REPO_DIR, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def cross_frame(centers, arm=40, half=6):
+    # Bright frame with a dark cross of the given arm length centered on every
+    # (row, col) of centers
+    image = np.full((480, 640), 200, dtype=np.uint8)
+    for row, col in centers:
+        image[row - arm:row + arm + 1, col - half:col + half + 1] = 30
+        image[row - half:row + half + 1, col - arm:col + arm + 1] = 30
+    return image
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_lost_target_times_out(backend):
+    # When one of two crosses disappears its target stays near where it was
+    # lost and times out, instead of growing its window until it takes over
+    # the other cross
+    both = cross_frame([(240, 160), (240, 479)])
+    one = cross_frame([(240, 479)])
+    t = tracker.Tracker(*PARAMS, backend=backend)
+    for frame_counter in range(40):
+        t.track_frame(both if frame_counter < 5 else one, frame_counter, BORDER, scan_period=50)
+        windows = t.tracking_windows(one.shape)[0]
+        assert all((window[3] - window[2]) < one.shape[1] // 2 for window in windows.tolist())
+    assert target_list(t) == [(240, 479, 41)]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_slow_motion_under_change_threshhold(backend):
+    # A soft edged cross moving 0.3 pixels a frame changes its blocks less
+    # than the change threshhold from one frame to the next, but the target is
+    # compared with the frame it was last found in, so it never falls behind
+    cross = cv2.GaussianBlur(cross_frame([(240, 200)]), (0, 0), 2.0)
+    t = tracker.Tracker(*PARAMS, backend=backend, change_threshhold=6)
+    for frame_counter in range(150):
+        shift = 0.3 * frame_counter
+        image = cv2.warpAffine(cross, np.float32([[1, 0, shift], [0, 1, 0]]), (640, 480),
+                               borderMode=cv2.BORDER_REPLICATE)
+        t.track_frame(image, frame_counter, BORDER, scan_period=50)
+        (_, _, col, _), = t.get_target_array().tolist()
+        assert abs(col - (200 + shift)) <= 2
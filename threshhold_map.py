@@ -0,0 +1,65 @@
+import numpy as np
+
+# Adaptive gradient threshholds. Instead of one global threshhold, every block
+# of block_size x block_size pixels gets its own from a decimated copy of the
+# frame: a fraction of the local contrast (brightest minus darkest pixel in the
+# block and its neighbours), so dim crosses still trigger when the lighting
+# drops, but at least a multiple of the mean gradient of the block, so textured
+# regions such as carpet do not flood the tracker with triggers. The result is
+# clipped to [minimum, maximum].
+
+
+class ThreshholdMap:
+    def __init__(self, contrast=0.25, noise=3, minimum=8, maximum=80, block_size=32, decimation=4):
+        self.contrast = contrast
+        self.noise = noise
+        self.minimum = minimum
+        self.maximum = maximum
+        self.block_size = block_size
+        self.decimation = decimation
+
+    def threshholds(self, image):
+        # Integer (block rows, block columns) array of the threshhold of every
+        # block of image
+        decimated = image[::self.decimation, ::self.decimation].astype(np.int32)
+        cells = self.block_size // self.decimation
+        row_starts = np.arange(0, decimated.shape[0], cells)
+        col_starts = np.arange(0, decimated.shape[1], cells)
+
+        brightest = np.maximum.reduceat(np.maximum.reduceat(decimated, row_starts, axis=0), col_starts, axis=1)
+        darkest = np.minimum.reduceat(np.minimum.reduceat(decimated, row_starts, axis=0), col_starts, axis=1)
+        contrast = spread_max(brightest - darkest)
+
+        # Mean absolute gradient between neighbouring decimated pixels of a row,
+        # the last column repeated to keep the blocks aligned
+        gradients = np.abs(np.diff(decimated, axis=1))
+        gradients = np.concatenate((gradients, gradients[:, -1:]), axis=1)
+        counts = np.outer(np.diff(np.append(row_starts, decimated.shape[0])),
+                          np.diff(np.append(col_starts, decimated.shape[1])))
+        noise = np.add.reduceat(np.add.reduceat(gradients, row_starts, axis=0), col_starts, axis=1) / counts
+
+        threshholds = np.maximum(self.contrast * contrast, self.noise * noise)
+        return np.clip(np.round(threshholds), self.minimum, self.maximum).astype(np.int64)
+
+    def grid(self, rows, cols, threshholds):
+        # Threshholds of the grid points rows x cols
+        block_rows = np.minimum(np.asarray(rows) // self.block_size, threshholds.shape[0] - 1)
+        block_cols = np.minimum(np.asarray(cols) // self.block_size, threshholds.shape[1] - 1)
+        return threshholds[np.ix_(block_rows, block_cols)]
+
+    def at(self, row, col, threshholds):
+        # Threshhold of the pixel (row, col), clamped to the blocks of the frame
+        block_row = min(max(int(row) // self.block_size, 0), threshholds.shape[0] - 1)
+        block_col = min(max(int(col) // self.block_size, 0), threshholds.shape[1] - 1)
+        return int(threshholds[block_row, block_col])
+
+
+def spread_max(values):
+    # Maximum of every cell and its 8 neighbours
+    rows = values.copy()
+    rows[1:] = np.maximum(rows[1:], values[:-1])
+    rows[:-1] = np.maximum(rows[:-1], values[1:])
+    spread = rows.copy()
+    spread[:, 1:] = np.maximum(spread[:, 1:], rows[:, :-1])
+    spread[:, :-1] = np.maximum(spread[:, :-1], rows[:, 1:])
+    return spread
@@ -1,44 +1,914 @@
 import numpy as np
+import itertools
 import math
+import mmap
+import time
+import warnings
+import tracker_numba
+import tracker_stats
+import worker_pool
+import association
+from change_detection import ChangeDetector
+from frame_maps import FrameMaps
+from template_bank import TemplateBank
+from threshhold_map import ThreshholdMap
+
+# Length of a target geometry, shared with the compiled backend
+GEOMETRY_SIZE = tracker_numba.GEOMETRY_SIZE
 
 def gradient(A, B):
     # Calculate an approximate gradient between two pixels values
     return int(A) - int(B)
 
 
-class Target:
-    def __init__(self, row, column, radius):
-        # Initialize tracker instance at center location (x,y)
-        self.loss_count = 0
-        self.center_row = row
-        self.center_col = column
-        self.radius = radius
-        self.prev_location = None
-
-
-    def update(self, row, column, radius):
-        self.prev_location = (self.center_row, self.center_col, self.radius)
-        self.loss_count = 0
-        self.center_row = row
-        self.center_col = column
-        self.radius = radius
+def gradient_triggers(image, rows, cols, offset, threshhold, free=None):
+    # Evaluate the rising gradient for every (row, col) of a sampling grid in a
+    # single array operation. Pixel values are truncated to integers first so the
+    # result matches gradient() exactly. Returns the trigger rows and columns in
+    # raster order (row by row, left to right). With a free mask of the grid
+    # (see free_grid) only the free points are evaluated. threshhold is a single
+    # value or an array with one per grid point (see threshhold_map).
+    rows = np.asarray(rows, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    if rows.size == 0 or cols.size == 0:
+        return rows[:0], cols[:0]
+
+    if free is not None:
+        point_rows, point_cols = np.nonzero(free)
+        point_rows = rows[point_rows]
+        point_cols = cols[point_cols]
+        gradients = image[point_rows, point_cols - offset].astype(np.int32) - image[point_rows, point_cols]
+        triggers = gradients > (threshhold[free] if np.ndim(threshhold) else threshhold)
+        return point_rows[triggers], point_cols[triggers]
+
+    grid = image[np.ix_(rows, cols)].astype(np.int32)
+    previous = image[np.ix_(rows, cols - offset)].astype(np.int32)
+    trigger_r, trigger_c = np.nonzero(previous - grid > threshhold)
+    return rows[trigger_r], cols[trigger_c]
+
+
+def inside_boxes(rows, cols, centers_row, centers_col, radii):
+    # Test every point against every box (center +/- radius, exclusive bounds) at
+    # once. Returns a boolean mask of points that fall inside at least one box.
+    inside = np.zeros(len(rows), dtype=bool)
+    if len(rows) == 0 or len(radii) == 0:
+        return inside
+
+    rows = np.asarray(rows)[:, None]
+    cols = np.asarray(cols)[:, None]
+    centers_row = np.asarray(centers_row)[None, :]
+    centers_col = np.asarray(centers_col)[None, :]
+    radii = np.asarray(radii)[None, :]
+    inside = ((centers_row - radii < rows) & (rows < centers_row + radii) &
+              (centers_col - radii < cols) & (cols < centers_col + radii))
+    return inside.any(axis=1)
+
+
+def free_grid(rows, cols, centers_row, centers_col, radii):
+    # Occupancy of the sampling grid rows x cols: a boolean mask that is False on
+    # every grid point inside a box (center +/- radius, exclusive bounds) and True
+    # elsewhere. Every box clears one block of the mask, so the cost only grows
+    # with the number of boxes and not with the number of points.
+    free = np.ones((len(rows), len(cols)), dtype=bool)
+    if len(radii) == 0:
+        return free
+
+    row_start = np.searchsorted(rows, np.asarray(centers_row) - radii, side="right")
+    row_stop = np.searchsorted(rows, np.asarray(centers_row) + radii, side="left")
+    col_start = np.searchsorted(cols, np.asarray(centers_col) - radii, side="right")
+    col_stop = np.searchsorted(cols, np.asarray(centers_col) + radii, side="left")
+    for box in zip(row_start.tolist(), row_stop.tolist(), col_start.tolist(), col_stop.tolist()):
+        free[box[0]:box[1], box[2]:box[3]] = False
+    return free
+
+
+def edge_profile(line, start, stop, step):
+    # Sample line[start:stop:step] as integers together with the sample one step
+    # before each of them. Returns (previous, current, raw) where raw keeps the
+    # original pixel values for intensity comparisons.
+    if start >= step:
+        samples = line[start - step:stop:step]
+        raw = samples[1:]
+        previous = samples[:-1].astype(np.int32)
+    else:
+        # The first sample looks back past the start of the line, which wraps
+        # around like scalar indexing does.
+        index = np.arange(start, stop, step)
+        raw = line[index]
+        previous = line[index - step].astype(np.int32)
+    return previous, raw.astype(np.int32), raw
+
+
+def trace_edges(previous, current, raw, threshhold, track_from_start):
+    # Follow one row or column profile of a bar. Returns a tuple of
+    # (cross_encounter, first_rising, first_falling, last_falling, min_intensity)
+    # where the indices refer to the profile and falling edges only count after
+    # the first rising edge. The minimum intensity skips those falling edges and,
+    # unless track_from_start is set, everything before the first rising edge.
+    gradients = previous - current
+    rising = gradients > threshhold
+    falling = gradients < -threshhold
+
+    first_rising = None
+    first_falling = None
+    last_falling = None
+    counted = np.ones(len(raw), dtype=bool)
+
+    rising_index = np.flatnonzero(rising)
+    if len(rising_index):
+        first_rising = int(rising_index[0])
+        falling_index = np.flatnonzero(falling[first_rising + 1:]) + first_rising + 1
+        if len(falling_index):
+            first_falling = int(falling_index[0])
+            last_falling = int(falling_index[-1])
+            counted[falling_index] = False
+        if not track_from_start:
+            counted[:first_rising] = False
+    elif not track_from_start:
+        counted[:] = False
+
+    cross_encounter = first_rising is not None or bool(falling.any())
+
+    min_intensity = 255
+    if counted.any():
+        min_intensity = min(min_intensity, raw[counted].min().item())
+
+    return cross_encounter, first_rising, first_falling, last_falling, min_intensity
+
+
+def find_bar_side(image, center_row, start_col, stop_col, col_step, up_down, min_intensity,
+                  scan_offset, target_offset, threshhold, maps=None):
+    # Step column by column away from the center of the cross, following the
+    # horizontal bar with vertical profiles, until a column no longer contains
+    # the dark cross. Returns (column, top, bottom) of that side, or None. The
+    # profiles are looked up in the FrameMaps of the image, if given.
+    up_down = list(up_down)
+    columns = maps.columns(scan_offset[0]) if maps is not None else None
+    for c in range(start_col, stop_col, col_step):
+
+        if c < 0 or c >= image.shape[1]:
+            return None
+
+        start = up_down[0] - target_offset
+        stop = up_down[1] + target_offset
+        if start < stop and (start < 0 or stop - 1 - (stop - 1 - start) % scan_offset[0] >= image.shape[0]):
+            return None
+
+        if columns is not None:
+            cross_encounter, first_rising, _, last_falling, min_col_intensity = columns.trace(c, start, stop, True)
+        else:
+            previous, current, raw = edge_profile(image[:, c], start, stop, scan_offset[0])
+            cross_encounter, first_rising, _, last_falling, min_col_intensity = trace_edges(
+                previous, current, raw, threshhold, True)
+
+        if first_rising is not None:
+            up_down[0] = start + first_rising * scan_offset[0]
+        if last_falling is not None:
+            up_down[1] = start + last_falling * scan_offset[0]
+
+        if not cross_encounter and abs(min_col_intensity - min_intensity) > threshhold:
+            return (c, up_down[0], up_down[1])
+
+    return None
+
+
+def unit_vector(x, y):
+    # Return the unit vector and length of (x, y)
+    length = math.sqrt(x * x + y * y)
+    return (x / length, y / length), length
+
+
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1]
+
+
+def dark_run(column, row, level, gap):
+    # Extent (first, last) of the run of pixels darker than level in column that
+    # contains row, bridging gaps of up to gap pixels
+    dark = np.flatnonzero(column < level)
+    index = np.searchsorted(dark, row)
+    if index == len(dark) or dark[index] != row:
+        return row, row
+
+    breaks = np.flatnonzero(np.diff(dark) > gap + 1)
+    run = np.searchsorted(breaks, index)
+    first = dark[breaks[run - 1] + 1] if run > 0 else dark[0]
+    last = dark[breaks[run]] if run < len(breaks) else dark[-1]
+    return int(first), int(last)
+
+
+def cascade_rejection(image, row, left, right, step, target_offset, threshhold, cascade):
+    # Early-reject cascade for a trigger whose bar starts with the rising edge at
+    # left and ends before the falling edge at right on its row, run before the
+    # bars are traced with the (row, col) sampling step. cascade holds the
+    # tracker_stats codes of the stages to run in order, each a cheap test every
+    # cross passes:
+    #  - SHORT_BAR: the dark run down the bar is too short for a bar this wide
+    #  - NO_ARMS: halfway along the run the horizontal arms are not dark, or the
+    #    four corners between the arms are not bright
+    # Pixels are dark when darker than the bright side of the rising edge by the
+    # threshhold. Returns the code of the first stage that fails, or ACCEPTED.
+    height, width = image.shape[:2]
+    bar_width = right - left
+    bar_col = left + int(np.argmin(image[row, left:max(right, left + 1)]))
+    level = int(image[row, left - step[1]]) - threshhold
+    top, bottom = dark_run(image[:, bar_col], row, level, step[0])
+
+    for stage in cascade:
+        if stage == tracker_stats.SHORT_BAR:
+            # The bar is at most half as wide as the cross is tall
+            if 2 * bar_width > bottom - top + 1 + 2 * target_offset:
+                return tracker_stats.SHORT_BAR
+
+        elif stage == tracker_stats.NO_ARMS:
+            # Probe the arms at half the shortest length they may have and the
+            # corners a quarter of the cross away from its center
+            center_row = (top + bottom) // 2
+            arm = max((bottom - top) // 2 - 2 * target_offset, 0) // 2
+            corner = max((bottom - top) // 4, bar_width)
+            if center_row - corner < 0 or center_row + corner >= height or \
+                    bar_col - max(arm, corner) < 0 or bar_col + max(arm, corner) >= width:
+                return tracker_stats.NO_ARMS
+            if not (image[center_row, bar_col - arm] < level and image[center_row, bar_col + arm] < level):
+                return tracker_stats.NO_ARMS
+            corners = image[[center_row - corner, center_row + corner]][:, [bar_col - corner, bar_col + corner]]
+            if (corners < level).any():
+                return tracker_stats.NO_ARMS
+
+    return tracker_stats.ACCEPTED
+
+
+def verify_cross(image, row, col, scan_offset, target_offset, threshhold, geometry=None, cascade=(), maps=None):
+    # Pinpoint the target center given the triggering index. Every row and column
+    # sweep is evaluated on an array slice of the image instead of pixel by pixel.
+    # Returns (is_target, center_row, center_column, radius), or (False, 0, 0,
+    # reason) with a tracker_stats reason code when rejected. When a target is
+    # found its bounds are also written to the geometry array, if given, as
+    # (top, bottom, left, right, vbar bounds, hbar bounds, row, col). The
+    # stages of cascade, if any, run before the bars are traced (see
+    # cascade_rejection).
+    # With the FrameMaps of the image (built for the same threshhold) the row
+    # and column profiles are looked up instead of sampled.
+    height, width = image.shape[:2]
+
+    # Define a smaller scan offset for the localized search so we can detect
+    # finer features
+    scan_offset = [math.ceil(scan_offset[0] / 2), math.ceil(scan_offset[1] / 2)]
+    rows = maps.rows(scan_offset[1]) if maps is not None else None
+
+    # Determine the initial scan width from the first rising gradient to the left
+    # and the first falling gradient to the right of the trigger
+    if rows is not None:
+        initial_left = rows.previous_rising(row, col)
+        initial_right = rows.next_falling(row, col)
+        if initial_left is None or initial_left <= 0 or initial_right is None:
+            return (False, 0, 0, tracker_stats.NO_EDGE)
+    else:
+        line = image[row]
+        index = np.arange(col, 0, -scan_offset[1])
+        left_hits = np.flatnonzero(line[index - scan_offset[1]].astype(np.int32) - line[index].astype(np.int32) > threshhold)
+        if not len(left_hits):
+            return (False, 0, 0, tracker_stats.NO_EDGE)
+        initial_left = col - int(left_hits[0]) * scan_offset[1]
+
+        previous, current, _ = edge_profile(line, col, width, scan_offset[1])
+        right_hits = np.flatnonzero(previous - current < -threshhold)
+        if not len(right_hits):
+            return (False, 0, 0, tracker_stats.NO_EDGE)
+        initial_right = col + int(right_hits[0]) * scan_offset[1]
+
+    if len(cascade):
+        rejection = cascade_rejection(image, row, initial_left, initial_right, scan_offset, target_offset,
+                                      threshhold, cascade)
+        if rejection:
+            return (False, 0, 0, rejection)
+
+    # Column numbers of the vertical bar top and bottom in the order:
+    # [top_left, top_right, bottom_left, bottom_right]
+    vbar_bounds = [None, None, None, None]
+
+    # Row numbers of top and bottom
+    top = None
+    bottom = None
+
+    # Keep track of the minimum intensity so we know what intensity black is
+    # regardless of color distortion
+    min_intensity = 255
+
+    # Bar width of previous row which is updated to track the bar, even when angled.
+    left_right = [initial_left, initial_right]
+    gradient_counter = 0
+
+    # Iterate through the rows until the bottom of the image.
+    for r in range(row - target_offset, height, scan_offset[0]):
+
+        # If our search goes outside of the boundaries, return.
+        if r < 0:
+            return (False, 0, 0, tracker_stats.OUT_OF_BOUNDS)
+
+        # The row profile spans the previous bar width, accounting for diagonal
+        # lines with the offset. If it goes outside the boundaries, return.
+        start = left_right[0] - target_offset
+        stop = left_right[1] + target_offset
+        if start < stop and (start < scan_offset[1] or stop - 1 - (stop - 1 - start) % scan_offset[1] >= width):
+            return (False, 0, 0, tracker_stats.OUT_OF_BOUNDS)
+
+        if rows is not None:
+            cross_encounter, first_rising, first_falling, last_falling, min_row_intensity = rows.trace(
+                r, start, stop, bool(top))
+        else:
+            previous, current, raw = edge_profile(image[r], start, stop, scan_offset[1])
+            cross_encounter, first_rising, first_falling, last_falling, min_row_intensity = trace_edges(
+                previous, current, raw, threshhold, bool(top))
+
+        # Left edge on the first rising gradient, right edge on the last falling
+        # gradient after it
+        if first_rising is not None:
+            left_right[0] = start + first_rising * scan_offset[1]
+            if not top:
+                top = r
+                vbar_bounds[0] = left_right[0]
+
+        # The intensity is only tracked once the top of the bar has been found
+        if not top:
+            min_row_intensity = 255
 
+        if last_falling is not None:
+            left_right[1] = start + last_falling * scan_offset[1]
+            if top and not vbar_bounds[1]:
+                vbar_bounds[1] = start + first_falling * scan_offset[1]
 
-    def lost(self):
-        # Increment loss counter
-        self.loss_count += 1
+        min_intensity = min(min_intensity, min_row_intensity)
 
+        if cross_encounter:
+            gradient_counter = 0
 
-    def get_center(self):
-        return (self.center_row, self.center_col)
+        # If a black pixel was not encountered in this row, mark the bottom
+        elif top and not ((min_row_intensity - min_intensity) < threshhold):
+            bottom = r - scan_offset[0]
+            vbar_bounds[2] = left_right[0]
+            vbar_bounds[3] = left_right[1]
+            break
+
+        else:
+            gradient_counter += 1
+
+        if gradient_counter > 1.5 * (initial_right - initial_left):
+            return (False, 0, 0, tracker_stats.LOST_BAR)
+
+    # If all of the features of the vertical bar were not detected, the feature
+    # is probably not a cross
+    if not top or not bottom or not all(vbar_bounds):
+        return (False, 0, 0, tracker_stats.INCOMPLETE_BAR)
+
+    # If the top and bottom were not similar in width
+    if abs((vbar_bounds[1] - vbar_bounds[0]) - (vbar_bounds[3] - vbar_bounds[2])) > target_offset:
+        return (False, 0, 0, tracker_stats.WIDTH_MISMATCH)
+
+    center_row = (top + bottom) // 2
+    center_column = int(sum(vbar_bounds) / 4)
+    column_radius = (vbar_bounds[1] - vbar_bounds[0]) // 2
+
+    if (vbar_bounds[1] - vbar_bounds[0]) > 0.5 * (bottom - top):
+        return (False, 0, 0, tracker_stats.ASPECT)
+
+    # Perform vertical scans from the center until we find the left and right edges
+    up_down = (center_row - column_radius, center_row + column_radius)
+    left_side = find_bar_side(image, center_row, center_column - column_radius, 0, -scan_offset[1], up_down,
+                              min_intensity, scan_offset, target_offset, threshhold, maps)
+    if left_side is None:
+        return (False, 0, 0, tracker_stats.OUT_OF_BOUNDS)
+
+    right_side = find_bar_side(image, center_row, center_column + column_radius, width, scan_offset[1], up_down,
+                               min_intensity, scan_offset, target_offset, threshhold, maps)
+    if right_side is None:
+        return (False, 0, 0, tracker_stats.OUT_OF_BOUNDS)
+
+    # [top_left, bottom_left, top_right, bottom_right]
+    left, right = left_side[0], right_side[0]
+    hbar_bounds = [left_side[1], left_side[2], right_side[1], right_side[2]]
+
+    # If all bounds were not satisfied
+    if not left or not right or not all(hbar_bounds):
+        return (False, 0, 0, tracker_stats.INCOMPLETE_BAR)
+
+    # If the right and left sides were not close to the same width
+    if abs((hbar_bounds[1] - hbar_bounds[0]) - (hbar_bounds[3] - hbar_bounds[2])) > target_offset:
+        return (False, 0, 0, tracker_stats.WIDTH_MISMATCH)
+
+    if (hbar_bounds[1] - hbar_bounds[0]) > 0.5 * (right - left):
+        return (False, 0, 0, tracker_stats.ASPECT)
+
+    # Find true center column
+    center_column = (right + left) // 2
+
+    # Extract the vectors of the four arms of the cross with the origin at the center
+    up_x, up_y = (vbar_bounds[1] + vbar_bounds[0]) / 2 - center_column, center_row - top
+    down_x, down_y = (vbar_bounds[3] + vbar_bounds[2]) / 2 - center_column, center_row - bottom
+    right_x, right_y = right - center_column, center_row - (hbar_bounds[3] + hbar_bounds[2]) / 2
+    left_x, left_y = left - center_column, center_row - (hbar_bounds[1] + hbar_bounds[0]) / 2
+    if (up_x == 0 and up_y == 0) or (down_x == 0 and down_y == 0) or \
+            (right_x == 0 and right_y == 0) or (left_x == 0 and left_y == 0):
+        return (False, 0, 0, tracker_stats.ARM_LENGTH)
+
+    up_unit, up_length = unit_vector(up_x, up_y)
+    down_unit, down_length = unit_vector(down_x, down_y)
+    right_unit, right_length = unit_vector(right_x, right_y)
+    left_unit, left_length = unit_vector(left_x, left_y)
+
+    # Check that vectors are about the same length
+    if abs(up_length - right_length) > 2 * target_offset:
+        return (False, 0, 0, tracker_stats.ARM_LENGTH)
+
+    # Check that vectors are not tiny
+    if down_length < target_offset or left_length < target_offset:
+        return (False, 0, 0, tracker_stats.ARM_LENGTH)
+
+    # Classify as not a cross if the angle is off by more than 15 degrees
+    if abs(dot(up_unit, right_unit)) > 0.25 or abs(dot(up_unit, left_unit)) > 0.25 or \
+            abs(dot(left_unit, down_unit)) > 0.25 or abs(dot(right_unit, down_unit)) > 0.25:
+        return (False, 0, 0, tracker_stats.ANGLE)
+
+    # Classify as not a cross if the opposite ends are not approximately parallel
+    if abs(abs(dot(up_unit, down_unit)) - 1) > 0.1 or abs(abs(dot(right_unit, left_unit)) - 1) > 0.1:
+        return (False, 0, 0, tracker_stats.PARALLELISM)
+
+    if geometry is not None:
+        geometry[:] = [top, bottom, left, right] + vbar_bounds + hbar_bounds + [row, col]
+
+    return (True, center_row, center_column, max(bottom - top, right - left) // 2)
+
+
+def verify_crosses(image, rows, cols, scan_offset, target_offset, threshhold, cascade=(), maps=None):
+    # Verify a batch of trigger points. Returns arrays of
+    # (is_target, center_row, center_column, radius), one entry per trigger.
+    # threshhold is a single value or one per trigger. The triggers share the
+    # FrameMaps of the image, if given.
+    count = len(rows)
+    is_target = np.zeros(count, dtype=bool)
+    centers_row = np.zeros(count, dtype=int)
+    centers_col = np.zeros(count, dtype=int)
+    radii = np.zeros(count, dtype=int)
+    threshholds = np.broadcast_to(threshhold, (count,)).tolist()
+    for i, (r, c) in enumerate(zip(np.asarray(rows).tolist(), np.asarray(cols).tolist())):
+        result = verify_cross(image, r, c, scan_offset, target_offset, threshholds[i], cascade=cascade, maps=maps)
+        if result[0]:
+            is_target[i], centers_row[i], centers_col[i], radii[i] = result
+    return is_target, centers_row, centers_col, radii
+
+
+def search_window(image, top, bottom, left, right, scan_offset, target_offset, threshhold, backend="python",
+                  origin=None, geometry=None, cascade=(), maps=None, stats=None):
+    # Search a tracking window and stop at the first confirmed target. Triggers are
+    # tried in raster order, or outward from origin (row, col) when it is given.
+    # Returns (is_found, center_row, center_column, radius), and writes the
+    # bounds of the target to geometry like verify_cross. Triggers go through the
+    # early-reject cascade first, if given, and the python backend pinpoints them
+    # with the FrameMaps of the image, if given. The work is counted in stats, if
+    # given.
+
+    # Every significant rising gradient (left side of the cross) in the window
+    rows = np.arange(top, bottom, scan_offset[0])
+    cols = np.arange(left + scan_offset[1], right, scan_offset[1])
+    trigger_rows, trigger_cols = gradient_triggers(image, rows, cols, scan_offset[1], threshhold)
+    if stats is not None:
+        stats.gradient_evaluations += len(rows) * len(cols)
+        stats.triggers += len(trigger_rows)
+
+    if origin is not None:
+        order = np.argsort((trigger_rows - origin[0]) ** 2 + (trigger_cols - origin[1]) ** 2, kind="stable")
+        trigger_rows = trigger_rows[order]
+        trigger_cols = trigger_cols[order]
+
+    if backend == "numba":
+        if geometry is None:
+            geometry = np.zeros(GEOMETRY_SIZE, dtype=np.int64)
+        reasons = np.full(len(trigger_rows), -1, dtype=np.int64)
+        result = tracker_numba.first_target(image, trigger_rows, trigger_cols, scan_offset[0], scan_offset[1],
+                                            target_offset, threshhold, geometry, np.asarray(cascade, dtype=np.int64),
+                                            reasons)
+        if stats is not None:
+            stats.count_reasons(reasons)
+        return result
+
+    # If the localized search finds a target, stop the search
+    for r, c in zip(trigger_rows.tolist(), trigger_cols.tolist()):
+        if stats is not None:
+            start = time.perf_counter()
+        result = verify_cross(image, r, c, scan_offset, target_offset, threshhold, geometry, cascade, maps)
+        if stats is not None:
+            stats.count_pinpoint(result, time.perf_counter() - start)
+        if result[0]:
+            return result
+
+    return (False, 0, 0, 0)
+
+
+def bar_edges(line, start, stop, step, threshhold):
+    # Sides of a dark bar crossing line[start:stop:step]: the first rising
+    # gradient and the first falling gradient after it. Returns None when the
+    # profile does not cross a bar.
+    previous, current, _ = edge_profile(line, start, stop, step)
+    gradients = previous - current
+    rising = np.flatnonzero(gradients > threshhold)
+    if not len(rising):
+        return None
+
+    first_rising = int(rising[0])
+    falling = np.flatnonzero(gradients[first_rising + 1:] < -threshhold)
+    if not len(falling):
+        return None
+
+    return (start + first_rising * step, start + (first_rising + 1 + int(falling[0])) * step)
+
+
+def probe_cross(image, previous, shift_row, shift_col, margin, scan_offset, target_offset, threshhold, geometry,
+                maps=None):
+    # Re-verify a target from its previous geometry, moved by (shift_row,
+    # shift_col). The sides of every arm are probed halfway along it first, all
+    # within margin of where they were, and the bars have to keep their width.
+    # The target is then traced from the trigger of its previous detection,
+    # moved the same way, so its bounds and radius are exactly those a pinpoint
+    # from that trigger finds. Returns (is_found, center_row, center_column,
+    # radius) and writes the new geometry like verify_cross.
+    rejected = (False, 0, 0, 0)
+    height, width = image.shape[:2]
+    step_row, step_col = math.ceil(scan_offset[0] / 2), math.ceil(scan_offset[1] / 2)
+
+    top, bottom = int(previous[0]) + shift_row, int(previous[1]) + shift_row
+    left, right = int(previous[2]) + shift_col, int(previous[3]) + shift_col
+    vbar_bounds = [int(b) + shift_col for b in previous[4:8]]
+    hbar_bounds = [int(b) + shift_row for b in previous[8:12]]
+    # The trigger moves in whole pinpoint steps, so the trace samples the same
+    # rows and columns as before unless the target moved by a step or more
+    trigger_row = int(previous[12]) + (shift_row + step_row // 2) // step_row * step_row
+    trigger_col = int(previous[13]) + (shift_col + step_col // 2) // step_col * step_col
+
+    center_row = (top + bottom) // 2
+    center_column = (left + right) // 2
+
+    # Sides of the vertical bar halfway along the up and down arms, and of the
+    # horizontal bar halfway along the left and right arms. Every probe stays
+    # within margin of the previous bounds and inside the image.
+    up_row = (top + center_row) // 2
+    down_row = (bottom + center_row) // 2
+    left_col = (left + center_column) // 2
+    right_col = (right + center_column) // 2
+    if up_row < 0 or down_row >= height or left_col < 0 or right_col >= width or \
+            not (0 <= trigger_row < height and 0 < trigger_col < width):
+        return rejected
+
+    up = bar_edges(image[up_row], max(vbar_bounds[0] - margin, step_col), min(vbar_bounds[1] + margin, width),
+                   step_col, threshhold)
+    down = bar_edges(image[down_row], max(vbar_bounds[2] - margin, step_col), min(vbar_bounds[3] + margin, width),
+                     step_col, threshhold)
+    left_side = bar_edges(image[:, left_col], max(hbar_bounds[0] - margin, step_row),
+                          min(hbar_bounds[1] + margin, height), step_row, threshhold)
+    right_side = bar_edges(image[:, right_col], max(hbar_bounds[2] - margin, step_row),
+                           min(hbar_bounds[3] + margin, height), step_row, threshhold)
+    if up is None or down is None or left_side is None or right_side is None:
+        return rejected
+
+    # The bars have to keep their width
+    if abs((up[1] - up[0]) - (vbar_bounds[1] - vbar_bounds[0])) > target_offset or \
+            abs((down[1] - down[0]) - (vbar_bounds[3] - vbar_bounds[2])) > target_offset or \
+            abs((left_side[1] - left_side[0]) - (hbar_bounds[1] - hbar_bounds[0])) > target_offset or \
+            abs((right_side[1] - right_side[0]) - (hbar_bounds[3] - hbar_bounds[2])) > target_offset:
+        return rejected
+
+    # A trace only finds the top of the vertical bar when it starts above it.
+    # While the top is on the first row traced, the target may have moved up
+    # more than predicted, and the trace starts again further up the bar. The
+    # first trace is kept when that finds the same top. The trigger column may
+    # have drifted off the bar, so that trace starts from the middle of the bar
+    # where its sides were probed. A trace that strays more than margin from
+    # the moved bounds has found some other cross.
+    def in_bounds(result):
+        return result[0] and abs(geometry[0] - top) <= margin and abs(geometry[1] - bottom) <= margin and \
+            abs(geometry[2] - left) <= margin and abs(geometry[3] - right) <= margin
+
+    rise = step_row * math.ceil(target_offset / step_row)
+    result = verify_cross(image, trigger_row, trigger_col, scan_offset, target_offset, threshhold, geometry,
+                          maps=maps)
+    bar_col = (up[0] + up[1]) // 2
+    while in_bounds(result) and geometry[0] <= trigger_row - target_offset and trigger_row >= rise:
+        found, previous_geometry = result, geometry.copy()
+        result = verify_cross(image, trigger_row - rise, bar_col, scan_offset, target_offset, threshhold,
+                              geometry, maps=maps)
+        if not in_bounds(result) or geometry[0] == previous_geometry[0]:
+            geometry[:] = previous_geometry
+            return found
+        trigger_row -= rise
+
+    return result if in_bounds(result) else rejected
+
+
+def track_target(image, window, origin, previous, shift, margin, scan_offset, target_offset, threshhold,
+                 backend="python", cascade=(), maps=None, stats=None):
+    # Find a tracked target again. With the geometry of the previous frame the
+    # target is probed where it is predicted to be, and only when that fails is
+    # the window searched outward from origin. Returns (is_found, center_row,
+    # center_column, radius, geometry), the geometry being None when not found.
+    geometry = np.zeros(GEOMETRY_SIZE, dtype=np.int64)
+    if previous is not None:
+        if stats is not None:
+            stats.probes += 1
+        if backend == "numba":
+            result = tracker_numba.probe_cross(image, previous, shift[0], shift[1], margin, scan_offset[0],
+                                               scan_offset[1], target_offset, threshhold, geometry)
+        else:
+            result = probe_cross(image, previous, shift[0], shift[1], margin, scan_offset, target_offset, threshhold,
+                                 geometry, maps)
+        if result[0]:
+            return tuple(result) + (geometry,)
+        if stats is not None:
+            stats.probe_failures += 1
+
+    result = search_window(image, *window, scan_offset, target_offset, threshhold, backend, origin, geometry, cascade,
+                           maps, stats)
+    return tuple(result) + (geometry if result[0] else None,)
+
+
+def inside_detections(row, col, detections):
+    # Whether (row, col) falls inside the box of any (trigger_row, trigger_col,
+    # center_row, center_col, radius) detection
+    for _, _, center_row, center_col, radius in detections:
+        if ((center_row - radius) < row < (center_row + radius)) and ((center_col - radius) < col < (center_col + radius)):
+            return True
+    return False
+
+
+def scan_band(image, rows, cols, boxes, scan_offset, target_offset, threshhold, backend="python", active=None,
+              cascade=(), maps=None, stats=None):
+    # Scan the grid rows x cols for targets, skipping triggers inside the boxes
+    # (centers_row, centers_col, radii) of known targets and inside targets found
+    # earlier in the band. An active mask of the grid restricts the scan to the
+    # points set in it, and triggers go through the early-reject cascade first, if
+    # given. threshhold is a single value or an array with one per grid point,
+    # each trigger being pinpointed with its own. The python backend pinpoints
+    # the triggers with the FrameMaps of the image, if given. Returns
+    # (trigger_row, trigger_col, center_row, center_col, radius) of every target
+    # found, in raster order. The work is counted in stats, if given.
+
+    # Find every rising gradient (left side of the cross) on the grid at once,
+    # leaving out the grid points covered by known targets
+    free = free_grid(rows, cols, *boxes) if len(boxes[2]) else None
+    if active is not None:
+        free = active if free is None else free & active
+    trigger_rows, trigger_cols = gradient_triggers(image, rows, cols, scan_offset[1], threshhold, free)
+    if stats is not None:
+        stats.gradient_evaluations += len(rows) * len(cols) if free is None else int(free.sum())
+        stats.triggers += len(trigger_rows)
+
+    # Threshhold of every trigger
+    if np.ndim(threshhold):
+        threshholds = threshhold[np.searchsorted(rows, trigger_rows), np.searchsorted(cols, trigger_cols)]
+    else:
+        threshholds = np.full(len(trigger_rows), threshhold, dtype=np.int64)
+
+    if backend == "numba":
+        reasons = np.full(len(trigger_rows), -1, dtype=np.int64)
+        count, found = tracker_numba.scan_triggers(image, trigger_rows, trigger_cols, scan_offset[0], scan_offset[1],
+                                                   target_offset, threshholds.astype(np.int64),
+                                                   np.asarray(cascade, dtype=np.int64), reasons)
+        if stats is not None:
+            stats.count_reasons(reasons)
+        return [tuple(f) for f in found[:count].tolist()]
+
+    detections = []
+    for r, c, th in zip(trigger_rows.tolist(), trigger_cols.tolist(), threshholds.tolist()):
+        # Skip the region of a target found earlier in this band
+        if inside_detections(r, c, detections):
+            continue
+
+        # Start a localized search to distinguish features from false positives
+        if stats is not None:
+            start = time.perf_counter()
+        is_target, center_row, center_column, radius = verify_cross(image, r, c, scan_offset, target_offset, th,
+                                                                    cascade=cascade, maps=maps)
+        if stats is not None:
+            stats.count_pinpoint((is_target, center_row, center_column, radius), time.perf_counter() - start)
+        if is_target:
+            detections.append((r, c, center_row, center_column, radius))
+
+    return detections
+
+
+def merge_detections(bands):
+    # Merge the detections of bands in raster order, dropping those whose trigger
+    # falls inside a target kept from an earlier band
+    merged = []
+    for detections in bands:
+        merged.extend([d for d in detections if not inside_detections(d[0], d[1], merged)])
+    return merged
+
+
+def downsample(image, factor):
+    # Average factor x factor blocks of the image, factor being a power of two,
+    # dropping the rows and columns that do not fill a whole block. The image is
+    # halved one level at a time by adding up its four 2 x 2 phases, which keeps
+    # the pixel type and is much cheaper than averaging the blocks in floating
+    # point.
+    while factor > 1:
+        image = image[:image.shape[0] // 2 * 2, :image.shape[1] // 2 * 2]
+        sums = image[0::2, 0::2].astype(np.promote_types(image.dtype, np.uint16))
+        sums += image[1::2, 0::2]
+        sums += image[0::2, 1::2]
+        sums += image[1::2, 1::2]
+        if np.issubdtype(image.dtype, np.integer):
+            image = ((sums + 2) // 4).astype(image.dtype)
+        else:
+            image = sums / 4
+        factor //= 2
+    return image
+
+
+class TargetTable:
+    # Tracked targets as a structure of arrays, one row per target. Every target
+    # has a stable id, the center and radius it was last found at, a constant
+    # velocity Kalman filter over (row, column, radius), a loss count and the
+    # geometry of its last detection. Rows [0, count) are in use and removing a
+    # target moves the last row into its place, so rows are not stable but ids
+    # are. The filter state is [row, column, radius, row velocity, column
+    # velocity, radius velocity] in pixels and pixels per frame.
+
+    # Standard deviation of a pinpointed center or radius (pixels)
+    MEASUREMENT_STD = 2.0
+
+    # Standard deviation of the change in velocity between frames (pixels/frame)
+    ACCELERATION_STD = 2.0
+
+    TRANSITION = np.block([[np.eye(3), np.eye(3)], [np.zeros((3, 3)), np.eye(3)]])
+    OBSERVATION = np.hstack([np.eye(3), np.zeros((3, 3))])
+    PROCESS_NOISE = np.block([[np.eye(3) / 4, np.eye(3) / 2], [np.eye(3) / 2, np.eye(3)]]) * ACCELERATION_STD ** 2
+    MEASUREMENT_NOISE = np.eye(3) * MEASUREMENT_STD ** 2
+
+    # Largest standard deviations of the predicted position and radius
+    # (pixels), so the window of a target that stays lost does not grow over
+    # the whole image
+    MAX_POSITION_STD = 20.0
+    MAX_RADIUS_STD = 5.0
+
+    def __init__(self, capacity=8):
+        self.count = 0
+        self.__next_id = 0
+        self.__arrays = {}
+        self.__allocate(capacity)
+
+
+    def __allocate(self, capacity):
+        # (Re)allocate every column with room for capacity targets, keeping the
+        # rows in use
+        shapes = {
+            "ids": ((), np.int64),
+            "centers": ((2,), np.int64),
+            "radii": ((), np.int64),
+            "states": ((6,), float),
+            "covariances": ((6, 6), float),
+            "loss_counts": ((), np.int64),
+            "geometries": ((GEOMETRY_SIZE,), np.int64),
+            "has_geometry": ((), bool),
+        }
+        arrays = {}
+        for name, (shape, dtype) in shapes.items():
+            arrays[name] = np.zeros((capacity,) + shape, dtype=dtype)
+            if name in self.__arrays:
+                arrays[name][:self.count] = self.__arrays[name][:self.count]
+        self.__arrays = arrays
+
+
+    def __len__(self):
+        return self.count
+
+
+    # Views of the rows in use
+    ids = property(lambda self: self.__arrays["ids"][:self.count])
+    centers = property(lambda self: self.__arrays["centers"][:self.count])
+    radii = property(lambda self: self.__arrays["radii"][:self.count])
+    states = property(lambda self: self.__arrays["states"][:self.count])
+    covariances = property(lambda self: self.__arrays["covariances"][:self.count])
+    loss_counts = property(lambda self: self.__arrays["loss_counts"][:self.count])
+    geometries = property(lambda self: self.__arrays["geometries"][:self.count])
+    has_geometry = property(lambda self: self.__arrays["has_geometry"][:self.count])
+
+
+    def add(self, row, column, radius, search_radius=20):
+        # Start tracking a target at (row, column). The velocity is unknown, its
+        # initial uncertainty puts search_radius at three standard deviations of
+        # the first prediction. Returns the id of the target.
+        if self.count == len(self.__arrays["ids"]):
+            self.__allocate(2 * self.count)
+
+        i = self.count
+        self.count += 1
+        target_id = self.__next_id
+        self.__next_id += 1
+
+        self.ids[i] = target_id
+        self.centers[i] = (row, column)
+        self.radii[i] = radius
+        self.states[i] = (row, column, radius, 0, 0, 0)
+        self.covariances[i] = np.diag([self.MEASUREMENT_STD ** 2] * 3 + [(search_radius / 3) ** 2] * 3)
+        self.loss_counts[i] = 0
+        self.has_geometry[i] = False
+        return target_id
+
+
+    def remove(self, index):
+        # Stop tracking the target in row index by moving the last row over it
+        last = self.count - 1
+        if index != last:
+            for array in self.__arrays.values():
+                array[index] = array[last]
+        self.count = last
+
+
+    def remove_where(self, mask):
+        # Remove every target where mask is set. Going from the last row down,
+        # the row moved into a removed one is always a row that stays.
+        for index in np.flatnonzero(mask)[::-1]:
+            self.remove(index)
+
+
+    def predict(self):
+        # Advance the filters of all targets by one frame
+        states = self.states
+        covariances = self.covariances
+        states[...] = states @ self.TRANSITION.T
+        covariances[...] = self.TRANSITION @ covariances @ self.TRANSITION.T + self.PROCESS_NOISE
+
+
+    def update(self, indices, measurements, geometries=None):
+        # Correct the filters of the targets in rows indices with their measured
+        # (row, column, radius), and store the geometries they were found with
+        # (None when unknown). Found targets are no longer lost.
+        indices = np.asarray(indices, dtype=np.intp)
+        if not len(indices):
+            return
+
+        measurements = np.asarray(measurements, dtype=np.int64).reshape(-1, 3)
+        self.centers[indices] = measurements[:, :2]
+        self.radii[indices] = measurements[:, 2]
+        self.loss_counts[indices] = 0
+        self.has_geometry[indices] = False
+        if geometries is not None:
+            for index, geometry in zip(indices.tolist(), geometries):
+                if geometry is not None:
+                    self.geometries[index] = geometry
+                    self.has_geometry[index] = True
+
+        states = self.states[indices]
+        covariances = self.covariances[indices]
+        residuals = measurements - states @ self.OBSERVATION.T
+        innovations = self.OBSERVATION @ covariances @ self.OBSERVATION.T + self.MEASUREMENT_NOISE
+        gains = covariances @ self.OBSERVATION.T @ np.linalg.inv(innovations)
+        self.states[indices] = states + (gains @ residuals[:, :, None])[:, :, 0]
+        self.covariances[indices] = (np.eye(6) - gains @ self.OBSERVATION) @ covariances
+
+
+    def lost(self, indices):
+        # Count a frame the targets in rows indices were not found in. Their
+        # geometry is stale from then on.
+        self.loss_counts[indices] += 1
+        self.has_geometry[indices] = False
+
+
+    def predicted_locations(self):
+        # Predicted (row, column, radius) of every target and their standard
+        # deviations, as two (count, 3) arrays
+        std = np.sqrt(np.diagonal(self.covariances, axis1=1, axis2=2)[:, :3])
+        std[:, :2] = np.minimum(std[:, :2], self.MAX_POSITION_STD)
+        std[:, 2] = np.minimum(std[:, 2], self.MAX_RADIUS_STD)
+        return self.states[:, :3], std
+
+
+    def boxes(self):
+        # Boxes (centers_row, centers_col, radii) of the targets
+        return (self.centers[:, 0], self.centers[:, 1], self.radii)
+
+
+    def free_grid(self, rows, cols):
+        # Mask of the points of the grid rows x cols outside every target box
+        return free_grid(rows, cols, *self.boxes())
 
 
 class Tracker:
-    def __init__(self, scan_offset, target_offset, threshhold, tracking_offset, tracking_timeout):
+    def __init__(self, scan_offset, target_offset, threshhold, tracking_offset, tracking_timeout, backend="python",
+                 workers=0, pool="thread", scan_divisions=4, pyramid_levels=0, change_threshhold=0,
+                 change_block=16, cascade=(), precompute=False, adaptive_threshhold=False, detector="raster",
+                 association=None, stats=False, stats_history=0):
         # Initialize tracker with scanning offset (row_offset, col_offset),
         # target bound offset, and gradient threshhold
 
-        self.__targets = []
+        self.__targets = TargetTable()
+
+        # Parameters to build trackers like this one in other processes
+        self.__params = dict(scan_offset=scan_offset, target_offset=target_offset, threshhold=threshhold,
+                             tracking_offset=tracking_offset, tracking_timeout=tracking_timeout, backend=backend,
+                             scan_divisions=scan_divisions, pyramid_levels=pyramid_levels,
+                             change_threshhold=change_threshhold, change_block=change_block, cascade=cascade,
+                             precompute=precompute, adaptive_threshhold=adaptive_threshhold, detector=detector,
+                             association=association)
 
         # (row_offset, col_offset) responsible for determining the distance
         # between samples within the global search.
@@ -57,10 +927,173 @@ class Tracker:
         # Number of frames to look before removing tracked target
         self.__tracking_timeout = tracking_timeout
 
+        # Implementation of the hot loops, either "python" or the compiled "numba"
+        # backend. Fall back to python when numba is not installed.
+        if backend not in ("python", "numba"):
+            raise ValueError("Unknown tracker backend: %s" % backend)
+        if backend == "numba" and not tracker_numba.available:
+            warnings.warn("numba is not installed, falling back to the python tracker backend")
+            backend = "python"
+        self.__backend = backend
+
+        # Optional worker pool ("thread" or "process") to search the windows of
+        # all tracked targets concurrently. 0 workers searches them in order.
+        self.__pool = worker_pool.WorkerPool(workers, pool) if workers else None
+
+        # Number of frames an incremental scan takes to cover the whole image, and
+        # the slice of scan rows to cover next
+        self.__scan_divisions = scan_divisions
+        self.__scan_slice = 0
+
+        # Number of times the frame is halved before a full scan. Crosses are
+        # detected on the coarse frame with the offsets above and only refined
+        # at full resolution, for frames larger than the offsets were picked for.
+        self.__pyramid_levels = pyramid_levels
+
+        # Optional change detection: a mean absolute difference per block of
+        # change_block pixels above change_threshhold marks the block changed.
+        # Targets in unchanged blocks keep their previous result and scans only
+        # cover blocks that changed since they were last scanned. 0 disables it.
+        self.__update_changes = None
+        self.__scan_changes = None
+        if change_threshhold:
+            self.__update_changes = ChangeDetector(change_threshhold, change_block)
+            self.__scan_changes = ChangeDetector(change_threshhold, change_block)
+
+        # Early-reject cascade: names of the cheap tests of tracker_stats.STAGES
+        # every trigger has to pass, in order, before its bars are traced
+        for stage in cascade:
+            if stage not in tracker_stats.STAGES:
+                raise ValueError("Unknown cascade stage: %s" % stage)
+        self.__cascade_stages = tuple(cascade)
+        self.__cascade = np.array([tracker_stats.STAGES[stage] for stage in cascade], dtype=np.int64)
+
+        # Optional per frame precomputation (python backend): the edges and
+        # range minimum tables of every row and column are built once per frame
+        # and shared by the target updates, the scan and every pinpoint of the
+        # frame, instead of sampling the image again for every trigger
+        self.__precompute = precompute
+
+        # Optional adaptive threshholds: a threshhold per block of the frame from
+        # its local contrast and texture (see threshhold_map), computed once per
+        # frame and used by every gradient test instead of the global threshhold
+        self.__threshhold_map = ThreshholdMap() if adaptive_threshhold else None
+
+        # How crosses are detected: "raster", tracing the bars from the
+        # gradient triggers of the scan grid, or "template", matching a bank of
+        # crosses over scale and rotation against the decimated frame (see
+        # template_bank), which also finds rotated crosses. Template detection
+        # replaces the scan grid, so pyramid levels, scan workers, change
+        # detection of the scan and the cascade do not apply to it.
+        if detector not in ("raster", "template"):
+            raise ValueError("Unknown tracker detector: %s" % detector)
+        self.__templates = TemplateBank() if detector == "template" else None
+
+        # Optional global data association, "greedy" or "hungarian". The
+        # detections of all tracked targets are matched with the targets in one
+        # step per frame, so two targets can no longer lock onto the same
+        # cross, and scan detections matched with a known target are not added
+        # again. None lets every target keep what its own window search found.
+        if association not in (None, "greedy", "hungarian"):
+            raise ValueError("Unknown association method: %s" % association)
+        self.__association = association
+
+        # Optional instrumentation: counters and timings of every frame, and a
+        # ring buffer of the last stats_history frames. Without stats nothing is
+        # counted or timed.
+        self.__stats = stats
+        self.__frame_stats = None
+        self.__stats_history = tracker_stats.StatsHistory(stats_history) if stats and stats_history else None
+
 
     def get_target_centers(self):
-        # Return the center of all tracked targets
-        return [t.get_center() for t in self.__targets]
+        # Return the (row, column) center of all tracked targets, as a view of the
+        # target table that changes with the next update
+        return self.__targets.centers
+
+
+    def get_target_ids(self):
+        # Stable ids of the tracked targets, in the same order as the centers
+        return self.__targets.ids
+
+
+    def get_target_array(self):
+        # Copy of the tracked targets as an (n, 4) array of
+        # (id, center_row, center_col, radius)
+        return np.column_stack([self.__targets.ids, self.__targets.centers, self.__targets.radii])
+
+
+    def track_frame(self, image, frame_counter, border=(10,10,10,10), scan_period=50, incremental=False):
+        # Process one frame of a stream the way the camera loop does: an
+        # incremental scan on every frame, or a full scan every scan_period frames
+        # and target updates in between
+        if incremental:
+            self.incremental_scan(image, border)
+        elif frame_counter % scan_period == 0:
+            self.scan(image, border)
+        elif len(self.__targets):
+            self.update_targets(image)
+
+
+    def process_stream(self, frames, border=(10,10,10,10), scan_period=50, incremental=False, workers=0,
+                       segment_length=500):
+        # Track a stream of grayscale frames: an iterator of frames, a (frames,
+        # height, width) array such as a memory mapped stack or the path of an
+        # .npy file, which is memory mapped. Yields the get_target_array of every
+        # frame, in order.
+        #
+        # With workers, the stream is cut into independent segments of
+        # segment_length frames tracked in parallel by that many processes, each
+        # segment starting with a full scan on a fresh tracker with the
+        # parameters of this one. Target ids stay unique over the whole stream
+        # but targets are not followed from one segment into the next. Memory
+        # mapped frames stay on disk, every worker maps the file and reads its
+        # own segment. Other frames go through shared memory up to one segment
+        # per worker at a time.
+        if isinstance(frames, str):
+            frames = np.load(frames, mmap_mode="r")
+
+        if not workers:
+            for frame_counter, image in enumerate(frames):
+                self.track_frame(image, frame_counter, border, scan_period, incremental)
+                yield self.get_target_array()
+            return
+
+        pool = worker_pool.WorkerPool(workers, "process")
+        try:
+            mapping = frames_mapping(frames)
+            frames = iter(frames) if mapping is None else frames
+            options = (self.__params, border, scan_period, incremental)
+            batch_start = 0
+            first_id = 0
+            while True:
+                if mapping is None:
+                    block = list(itertools.islice(frames, pool.workers * segment_length))
+                    if not block:
+                        break
+                    segments = [(start, min(start + segment_length, len(block))) + options
+                                for start in range(0, len(block), segment_length)]
+                    results = pool.map_frame(track_segment, np.stack(block), segments)
+                else:
+                    batch_stop = min(batch_start + pool.workers * segment_length, len(frames))
+                    if batch_start == batch_stop:
+                        break
+                    segments = [(mapping, start, min(start + segment_length, batch_stop)) + options
+                                for start in range(batch_start, batch_stop, segment_length)]
+                    results = pool.map(track_segment, segments)
+                    batch_start = batch_stop
+
+                for arrays in results:
+                    last_id = first_id
+                    for targets in arrays:
+                        targets[:, 0] += first_id
+                        if len(targets):
+                            last_id = max(last_id, int(targets[:, 0].max()) + 1)
+                        yield targets
+                    first_id = last_id
+
+        finally:
+            pool.close()
 
 
     def scan(self, image, border=(10,10,10,10)):
@@ -68,446 +1101,445 @@ class Tracker:
         # Border is the amount of pixels around the edges that is not scanned
         # border = (top_margin, bottom_margin, left_margin, right_margin)
 
-        self.update_targets(image)
+        stats = self.__begin_stats()
+        maps = self.frame_maps(image)
+        blocks = self.__frame_threshholds(image)
+        self.__update_targets(image, maps, blocks, stats)
+        start = time.perf_counter() if stats else 0
 
         # Remove targets that were not found in the update before starting a full scan.
-        i = 0
-        while i < len(self.__targets):
-            if self.__targets[i].loss_count:
-                self.__targets.pop(i)
-            i += 1
-
-        for r in range(border[0], image.shape[0] - border[1], self.__scan_offset[0]):
-            for c in range(border[2], image.shape[1] - border[3], self.__scan_offset[1]):
-
-                # If we find a significant rising gradient (left side of the cross),
-                # start a localized search to distinguish features from false positives
-                if gradient(image[r,c-self.__scan_offset[1]], image[r,c]) > self.__threshhold:
-                    inside_target = False
-                    for t in self.__targets:
-                        # Skip the region that has already had a target
-                        if ((t.center_row - t.radius) < r < (t.center_row + t.radius)) and ((t.center_col - t.radius) < c < (t.center_col + t.radius)):
-                            inside_target = True
-                            break
-
-                    if inside_target:
-                        continue
-
-                    # If the localized search finds a target, stop the global search
-                    is_target, center_row, center_column, radius = self.pinpoint_target(image, r, c)
-                    if is_target:
-                        self.__targets.append(Target(center_row, center_column, radius))
+        self.__targets.remove_where(self.__targets.loss_counts > 0)
+
+        # Sampling grid of the scan and the boxes of the regions that already
+        # have a target
+        rows = np.arange(border[0], image.shape[0] - border[1], self.__scan_offset[0])
+        cols = np.arange(border[2], image.shape[1] - border[3], self.__scan_offset[1])
+        boxes = self.__targets.boxes()
+
+        # Blocks that did not change since the last scan are not scanned again
+        changed = self.__scan_changes.changes(image) if self.__scan_changes else None
+
+        if self.__templates:
+            detections = self.__template_scan(image, border[0], image.shape[0] - border[1], border, boxes)
+
+        elif self.__pyramid_levels:
+            detections = self.__pyramid_scan(image, border, boxes, changed, maps, blocks, stats)
+
+        elif self.__pool and self.__pool.workers > 1:
+            # Split the grid into horizontal bands scanned in parallel. Every worker
+            # sees the whole frame, so crosses crossing a band boundary are traced
+            # in full by the band holding their first trigger.
+            active = self.__scan_changes.grid_mask(rows, cols, changed) if self.__scan_changes else None
+            bands = [band for band in np.array_split(np.arange(len(rows)), self.__pool.workers) if len(band)]
+            args = [(rows[band], cols, boxes, self.__scan_offset, self.__target_offset,
+                     self.__grid_threshholds(rows[band], cols, blocks), self.__backend,
+                     None if active is None else active[band], self.__cascade, self.__shared(maps))
+                    for band in bands]
+            detections = merge_detections(self.__map(scan_band, image, args, stats))
+
+        else:
+            active = self.__scan_changes.grid_mask(rows, cols, changed) if self.__scan_changes else None
+            detections = scan_band(image, rows, cols, boxes, self.__scan_offset, self.__target_offset,
+                                   self.__grid_threshholds(rows, cols, blocks), self.__backend, active, self.__cascade,
+                                   maps, stats)
+
+        self.__add_detections(detections)
+
+        if self.__scan_changes:
+            self.__scan_changes.accept()
+
+        if stats:
+            stats.scan_time += time.perf_counter() - start
+        self.__end_stats(stats)
+
+
+    def __pyramid_scan(self, image, border, boxes, changed=None, maps=None, blocks=None, stats=None):
+        # Detect crosses on a downsampled frame, then refine every candidate in a
+        # small full resolution window around it. The coarse frame is scanned
+        # with the offsets of the tracker as they are, so its grid has factor**2
+        # fewer points than a full resolution scan and only confirmed coarse
+        # crosses are pinpointed at full resolution. This only pays off when
+        # the crosses are large enough in the frame to be found with these
+        # offsets at the coarse resolution, such as at twice the resolution
+        # the offsets were picked for. maps are the FrameMaps and blocks the
+        # adaptive threshholds of the full resolution frame, if any.
+        factor = 2 ** self.__pyramid_levels
+        coarse = downsample(image, factor)
+        rows = np.arange(border[0] // factor, coarse.shape[0] - border[1] // factor, self.__scan_offset[0])
+        cols = np.arange(border[2] // factor, coarse.shape[1] - border[3] // factor, self.__scan_offset[1])
+        active = self.__scan_changes.grid_mask(rows * factor, cols * factor, changed) if changed is not None else None
+        candidates = scan_band(coarse, rows, cols, tuple(b / factor for b in boxes), self.__scan_offset,
+                               self.__target_offset, self.__grid_threshholds(rows * factor, cols * factor, blocks),
+                               self.__backend, active, self.__cascade, self.frame_maps(coarse), stats)
+
+        # The window covers the upper arm of the cross, from above the top of the
+        # vertical bar where the raster search triggers first down to the
+        # center, and is searched in raster order
+        windows = []
+        for trigger_row, _, center_row, center_col, radius in candidates:
+            reach = (self.__scan_offset[0] + 1) * factor + self.__target_offset
+            # Align the window to the full resolution scan grid so it samples the
+            # same rows and columns as a full resolution scan would
+            top = trigger_row * factor - reach
+            top = max(top - (top - border[0]) % self.__scan_offset[0], 0)
+            left = (center_col - radius) * factor - reach
+            left = max(left - (left - border[2]) % self.__scan_offset[1], 0)
+            windows.append((top, min(center_row * factor + reach, image.shape[0]), left,
+                            min((center_col + radius) * factor + reach, image.shape[1])))
+
+        args = [w + (self.__scan_offset, self.__target_offset,
+                     self.__threshhold_at((w[0] + w[1]) // 2, (w[2] + w[3]) // 2, blocks), self.__backend, None, None,
+                     self.__cascade, self.__shared(maps)) for w in windows]
+        results = self.__map(search_window, image, args, stats)
+
+        # Only keep candidates confirmed at full resolution, dropping those that
+        # refined onto a cross found already
+        detections = []
+        for is_found, center_row, center_col, radius in results:
+            if is_found and not inside_detections(center_row, center_col, detections):
+                detections.append((center_row, center_col, center_row, center_col, radius))
+
+        return detections
+
+
+    def __add_detections(self, detections):
+        # Start tracking the (trigger_row, trigger_col, center_row, center_col,
+        # radius) detections of a scan. With association, detections on the same
+        # cross are merged and those matched with a known target, the same
+        # cross found again, are dropped.
+        targets = self.__targets
+        if self.__association and detections:
+            found = np.array([d[2:] for d in detections]).reshape(-1, 3)
+            found = found[association.suppress_duplicates(found[:, 0], found[:, 1], found[:, 2])]
+            if len(targets):
+                # A detection matches a target when its center is within the
+                # corners of the target box
+                costs = association.distance_costs(targets.centers[:, 0], targets.centers[:, 1],
+                                                   np.maximum(targets.radii, 1), found[:, 0], found[:, 1])
+                _, matched = association.assign(costs, 2, self.__association)
+                found = np.delete(found, matched, axis=0)
+            detections = [(0, 0) + tuple(d) for d in found.tolist()]
+
+        for _, _, center_row, center_col, radius in detections:
+            targets.add(center_row, center_col, radius, self.__tracking_offset)
+
+
+    def __associate(self, tracked, results, static):
+        # Match the targets in rows tracked with everything their window
+        # searches found, (is_found, center_row, center_col, radius, geometry)
+        # results. Detections on the cross of a static target or on the same
+        # cross as an earlier one are dropped, and every target only gets a
+        # detection within its window. Returns the results of the tracked
+        # targets after the assignment.
+        targets = self.__targets
+        assigned = [(False, 0, 0, 0, None)] * len(tracked)
+        detections = [result for result in results if result[0]]
+        if not detections:
+            return assigned
+
+        found = np.array([d[1:4] for d in detections]).reshape(-1, 3)
+        keep = association.suppress_duplicates(found[:, 0], found[:, 1], found[:, 2])
+        kept = np.flatnonzero(static)
+        if len(kept):
+            keep &= ~inside_boxes(found[:, 0], found[:, 1], targets.centers[kept, 0], targets.centers[kept, 1],
+                                  targets.radii[kept])
+        found = found[keep]
+        detections = [d for d, k in zip(detections, keep.tolist()) if k]
+
+        # Costs in units of the half size of the tracking window, so the
+        # gate reaches its corners
+        location, std = targets.predicted_locations()
+        location, std = location[tracked], std[tracked]
+        scales = location[:, 2] + 3 * std[:, 2] + self.__target_offset + 3 * std[:, :2].max(axis=1)
+        costs = association.distance_costs(location[:, 0], location[:, 1], np.maximum(scales, 1),
+                                           found[:, 0], found[:, 1])
+        for t, d in zip(*association.assign(costs, 2, self.__association)):
+            assigned[t] = detections[d]
+        return assigned
+
+
+    def __template_scan(self, image, top, bottom, border, boxes):
+        # Detect crosses centered in the rows [top, bottom) of the frame inside
+        # border with the template bank, leaving out those inside the boxes of
+        # known targets. Returns detections like scan_band, the center standing
+        # in for the trigger.
+        found = self.__templates.detect(image, top, bottom, border[2], image.shape[1] - border[3])
+        detections = [(row, col, row, col, radius) for row, col, radius in found]
+        if len(boxes[2]) and detections:
+            known = inside_boxes([d[0] for d in detections], [d[1] for d in detections], *boxes)
+            detections = [d for d, inside in zip(detections, known.tolist()) if not inside]
+        return detections
+
+
+    def incremental_scan(self, image, border=(10,10,10,10)):
+        # Spread a full scan over scan_divisions frames. Every call updates the
+        # tracked targets, whose windows grow while they are lost, and then scans
+        # the next slice of rows for new targets, so every cross is discovered
+        # within scan_divisions frames at a flat per frame cost.
+        stats = self.__begin_stats()
+        maps = self.frame_maps(image)
+        blocks = self.__frame_threshholds(image)
+        self.__update_targets(image, maps, blocks, stats)
+        start = time.perf_counter() if stats else 0
+
+        rows = np.arange(border[0], image.shape[0] - border[1], self.__scan_offset[0])
+        cols = np.arange(border[2], image.shape[1] - border[3], self.__scan_offset[1])
+
+        # Scan the next slice of rows for new targets
+        band = np.array_split(rows, self.__scan_divisions)[self.__scan_slice]
+        self.__scan_slice = (self.__scan_slice + 1) % self.__scan_divisions
+        active = None
+        if self.__templates:
+            detections = self.__template_scan(image, band[0], band[-1] + 1, border,
+                                              self.__targets.boxes()) if len(band) else []
+        else:
+            if self.__scan_changes and len(band):
+                active = self.__scan_changes.grid_mask(band, cols, self.__scan_changes.changes(image))
+            detections = scan_band(image, band, cols, self.__targets.boxes(), self.__scan_offset,
+                                   self.__target_offset, self.__grid_threshholds(band, cols, blocks), self.__backend,
+                                   active, self.__cascade, maps, stats)
+        self.__add_detections(detections)
+
+        if active is not None:
+            self.__scan_changes.accept(band[0], band[-1] + 1)
+
+        if stats:
+            stats.scan_time += time.perf_counter() - start
+        self.__end_stats(stats)
 
 
     def update_targets(self, image):
-        # Update all targets without scanning the whole image
-        i = 0
-        while i < len(self.__targets):
-            row_offset = 0
-            col_offset = 0
-            depth_offset = 0
-            tracking_offset = self.__tracking_offset
-            if self.__targets[i].prev_location:
-                row_offset = self.__targets[i].center_row - self.__targets[i].prev_location[0]
-                col_offset = self.__targets[i].center_col - self.__targets[i].prev_location[1]
-                depth_offset = self.__targets[i].radius - self.__targets[i].prev_location[2]
-                depth_offset *= depth_offset > 0
-                if self.__targets[i].loss_count:
-                    interpolation_factor = 3 - 4 * np.exp(-self.__targets[i].loss_count / 2)
-                    row_offset *= interpolation_factor
-                    col_offset *= interpolation_factor
-                    depth_offset *= interpolation_factor
-                    tracking_offset *= interpolation_factor
-
-            elif self.__targets[i].loss_count:
-                tracking_offset *= 2
-
-            top = int(self.__targets[i].center_row - self.__targets[i].radius + row_offset - depth_offset - tracking_offset)
-            bottom = int(self.__targets[i].center_row + self.__targets[i].radius + row_offset + depth_offset + tracking_offset)
-            left = int(self.__targets[i].center_col - self.__targets[i].radius + col_offset - depth_offset - tracking_offset)
-            right = int(self.__targets[i].center_col + self.__targets[i].radius + col_offset + depth_offset + tracking_offset)
-
-            if top < 0 or left < 0 or bottom > image.shape[0] or right > image.shape[1]:
-                self.__targets.pop(i)
-                continue
-
-            # (DEBUG)
-            # try:
-            #     self.__rgb[top,left:right] = [0,255,0]
-            #     self.__rgb[bottom,left:right] = [0,255,0]
-            #     self.__rgb[top:bottom,left] = [0,255,0]
-            #     self.__rgb[top:bottom,right] = [0,255,0]
-            # except:
-            #     None
-
-            complete = False
-            is_found = False
-            center_row = 0
-            center_col = 0
-            radius = 0
-
-            for r in range(top, bottom, self.__scan_offset[0]):
-                for c in range(left + self.__scan_offset[1], right, self.__scan_offset[1]):
-
-                    # If we find a significant rising gradient (left side of the cross),
-                    # start a localized search to distinguish features from false positives
-                    if gradient(image[r,c-self.__scan_offset[1]], image[r,c]) > self.__threshhold:
-
-                        # If the localized search finds a target, stop the global search
-                        is_found, center_row, center_column, radius = self.pinpoint_target(image, r, c)
-                        if is_found:
-                            complete = True
-                            break
-
-                if complete:
-                    break
-
-            if is_found:
-                self.__targets[i].update(center_row, center_column, radius)
-
-            else:
-                self.__targets[i].lost()
-                if self.__targets[i].loss_count > self.__tracking_timeout:
-                    self.__targets.pop(i)
-                    continue
-
-            i += 1
-
-
-    def pinpoint_target(self, image, row, col):
-        # Pinpoint the target center given the triggering index
-
-        # Define a smaller scan offset for the localized search so we can detect
-        # finer features
-        scan_offset = [math.ceil(self.__scan_offset[0] / 2), math.ceil(self.__scan_offset[1] / 2)]
-
-        # Determine the initial scan width
-        initial_left = None
-        for c in range(col, 0, -scan_offset[1]):
-            if gradient(image[row, c-scan_offset[1]], image[row,c]) > self.__threshhold:
-                initial_left = c
-                break
-
-        if not initial_left:
-            return (False, 0, 0, 0)
-
-        initial_right = None
-        for c in range(col, image.shape[1], scan_offset[1]):
-            if gradient(image[row,c-scan_offset[1]], image[row,c]) < -self.__threshhold:
-                initial_right = c
-                break
-
-        if not initial_right:
-            return (False, 0, 0, 0)
-
-        # Column numbers of the vertical bar top and bottom in the order:
-        # [top_left, top_right, bottom_left, bottom_right]
-        vbar_bounds = [None, None, None, None]
-
-        # Row numbers of top and bottom
-        top = None
-        bottom = None
-
-        # Keep track of the minimum intensity so we know what intensity black is
-        # regardless of color distortion
-        min_intensity = 255
-
-        # Bar width of previous row which is updated to track the bar, even when angled.
-        # Search starts at the column of the detected feature with offset on
-        # both sides.
-        left_right = [initial_left, initial_right]
-        gradient_counter = 0
-
-        # Iterate through the rows until the bottom of the image.
-        for r in range(row - self.__target_offset, image.shape[0], scan_offset[0]):
-
-            # If our search goes outside of the boundaries, return.
-            if r < 0 or r >= image.shape[0]:
-                return (False, 0, 0, 0)
-
-            # Per row, keep track of whether the left edge was triggered
-            edge_trigger = False
-
-            # Keep track whether either gradient was triggered so we know if we
-            # are still in the bounds of the object
-            cross_encounter = False
-
-            # Keep track of the minimum row intensity to know whether the row
-            # contained a black pixel or not.
-            min_row_intensity = 255
+        # Update all targets without scanning the whole image. Every target is
+        # predicted one frame ahead and probed there, falling back to a search of
+        # its window outward from the prediction. All targets are tracked first,
+        # possibly concurrently, and the results are then applied together.
+        stats = self.__begin_stats()
+        self.__update_targets(image, self.frame_maps(image), self.__frame_threshholds(image), stats)
+        self.__end_stats(stats)
+
+
+    def __update_targets(self, image, maps=None, blocks=None, stats=None):
+        start = time.perf_counter() if stats else 0
+        targets = self.__targets
+
+        # Targets found in the last frame whose blocks did not change since are
+        # where they were, and keep their result
+        static = np.zeros(len(targets), dtype=bool)
+        if self.__update_changes:
+            changed = self.__update_changes.changes(image)
+            reach = targets.radii + self.__target_offset
+            for i in np.flatnonzero(targets.loss_counts == 0):
+                row, col = targets.centers[i]
+                static[i] = not self.__update_changes.window_changed(
+                    changed, max(row - reach[i], 0), row + reach[i], max(col - reach[i], 0), col + reach[i])
+
+        targets.predict()
+        windows, origins, shifts, margins, inside = self.tracking_windows(image.shape)
+        kept = np.flatnonzero(static)
+        targets.update(kept, np.column_stack([targets.centers[kept], targets.radii[kept]]),
+                       [targets.geometries[i].copy() if targets.has_geometry[i] else None for i in kept])
+
+        # Targets whose predicted center leaves the image are not searched
+        inside |= static
+        tracked = np.flatnonzero(inside & ~static)
+        if self.__templates:
+            # Match the templates near the size of the target in its window
+            results = [self.__templates.search(image, *windows[i].tolist(), radius=int(targets.radii[i])) + (None,)
+                       for i in tracked]
+        else:
+            args = [(tuple(windows[i].tolist()), tuple(origins[i].tolist()),
+                     targets.geometries[i] if targets.has_geometry[i] else None,
+                     tuple(shifts[i].tolist()), int(margins[i]), self.__scan_offset, self.__target_offset,
+                     self.__threshhold_at((windows[i, 0] + windows[i, 1]) // 2, (windows[i, 2] + windows[i, 3]) // 2,
+                                          blocks), self.__backend, self.__cascade, self.__shared(maps))
+                    for i in tracked]
+            results = self.__map(track_target, image, args, stats)
+        if self.__association:
+            results = self.__associate(tracked, results, static)
+
+        # A detection far from the predicted radius is some other cross
+        location, std = targets.predicted_locations()
+        tolerance = 3 * std[tracked, 2] + self.__target_offset
+        found = np.array([result[0] and abs(result[3] - location[i, 2]) <= tolerance[k]
+                          for k, (i, result) in enumerate(zip(tracked.tolist(), results))], dtype=bool)
+        targets.update(tracked[found], [result[1:4] for result, f in zip(results, found) if f],
+                       [result[4] for result, f in zip(results, found) if f])
+        targets.lost(tracked[~found])
+
+        # Static targets keep being compared with the frame their result came
+        # from. The targets searched again are compared with this frame from now
+        # on, over their window and around where they were found.
+        if self.__update_changes:
+            for i in tracked.tolist():
+                self.__update_changes.accept(*windows[i].tolist())
+            reach = targets.radii + self.__target_offset
+            for i in tracked[found].tolist():
+                row, col = targets.centers[i]
+                self.__update_changes.accept(max(row - reach[i], 0), row + reach[i], max(col - reach[i], 0),
+                                             col + reach[i])
+
+        # Drop the targets that left the image or timed out
+        targets.remove_where(~inside | (targets.loss_counts > self.__tracking_timeout))
+
+        if stats:
+            stats.update_time += time.perf_counter() - start
+
+
+    def __map(self, function, image, args_list, stats=None):
+        # Run function(image, *args) for every args of args_list, on the worker
+        # pool if there is one, and return the results in order. The work is
+        # counted in stats, if given, also when it runs in other processes.
+        if not self.__pool:
+            return [function(image, *args, stats=stats) for args in args_list]
+        if stats is None:
+            return self.__pool.map_frame(function, image, args_list)
+
+        results = []
+        for result, task_stats in self.__pool.map_frame(tracker_stats.instrumented_task, image,
+                                                        [(function,) + tuple(args) for args in args_list]):
+            stats.merge(task_stats)
+            results.append(result)
+        return results
+
+
+    def frame_maps(self, image):
+        # FrameMaps of image to share between the pinpoints of one frame, or None
+        # when the tracker does not precompute them. They are built for the
+        # global threshhold, so adaptive threshholds go without.
+        if not self.__precompute or self.__backend != "python" or self.__threshhold_map:
+            return None
+        return FrameMaps(image, self.__threshhold)
+
+
+    def __frame_threshholds(self, image):
+        # Adaptive threshhold of every block of image, or None for the global one
+        return self.__threshhold_map.threshholds(image) if self.__threshhold_map else None
+
+
+    def __grid_threshholds(self, rows, cols, blocks):
+        # Threshhold of every point of the grid rows x cols, or the global one
+        if blocks is None:
+            return self.__threshhold
+        return self.__threshhold_map.grid(rows, cols, blocks)
+
+
+    def __threshhold_at(self, row, col, blocks):
+        # Threshhold of the pixel (row, col), or the global one
+        if blocks is None:
+            return self.__threshhold
+        return self.__threshhold_map.at(row, col, blocks)
+
+
+    def __shared(self, maps):
+        # The FrameMaps to hand to the worker pool. Threads share them, but worker
+        # processes only get the frame and would have to be sent all the tables.
+        return maps if not self.__pool or self.__pool.kind == "thread" else None
+
+
+    def __begin_stats(self):
+        # Start the stats of a new frame, or return None without instrumentation
+        if not self.__stats:
+            return None
+        self.__frame_stats = tracker_stats.FrameStats(self.__cascade_stages)
+        return self.__frame_stats
+
+
+    def __end_stats(self, stats):
+        if stats and self.__stats_history is not None:
+            self.__stats_history.append(stats)
+
+
+    def get_frame_stats(self):
+        # FrameStats of the last frame, or None without instrumentation
+        return self.__frame_stats
+
+
+    def get_stats_history(self):
+        # StatsHistory ring buffer of the last frames, or None
+        return self.__stats_history
+
+
+    def tracking_windows(self, shape):
+        # Where to look for every target in the next frame of the given shape.
+        # Returns (count, n) arrays of:
+        #  - windows (top, bottom, left, right) covering three standard deviations
+        #    of the predicted center and radius around the cross, clipped to the
+        #    image
+        #  - origins (row, column) a window search spreads out from: the predicted
+        #    top of the vertical bar, where the first trigger of the cross is
+        #    expected
+        #  - shifts (rows, columns), the predicted motion since the target was
+        #    last found, and margins, how far from their previous bounds its edges
+        #    are probed: three standard deviations of the predicted position
+        #  - whether the predicted center is still inside the image
+        targets = self.__targets
+        location, std = targets.predicted_locations()
+        row, col, radius = location.T
+        row_std, col_std, radius_std = std.T
 
-            # Iterate between the position of the previous layer, accounting for
-            # diagonal lines with the offset.
-            for c in range(left_right[0] - self.__target_offset, left_right[1] + self.__target_offset, scan_offset[1]):
+        inside = (row >= 0) & (row < shape[0]) & (col >= 0) & (col < shape[1])
+        reach = radius + 3 * radius_std + self.__target_offset
+        windows = np.stack([np.maximum(row - reach - 3 * row_std, 0),
+                            np.minimum(row + reach + 3 * row_std, shape[0]),
+                            np.maximum(col - reach - 3 * col_std, 0),
+                            np.minimum(col + reach + 3 * col_std, shape[1])], axis=1).astype(int)
+        origins = np.stack([row - radius, col], axis=1)
+        shifts = np.round(location[:, :2] - targets.centers).astype(int)
+        margins = np.ceil(3 * np.maximum(row_std, col_std)).astype(int) + self.__target_offset
+        return windows, origins, shifts, margins, inside
+
+
+    def pinpoint_target(self, image, row, col, maps=None):
+        # Pinpoint the target center given the triggering index. Calls on the
+        # same frame can share its frame_maps.
+        if self.__backend == "numba":
+            return tracker_numba.pinpoint_target(image, row, col, self.__scan_offset[0], self.__scan_offset[1],
+                                                 self.__target_offset, self.__threshhold, self.__cascade)
+        return verify_cross(image, row, col, self.__scan_offset, self.__target_offset, self.__threshhold,
+                            cascade=self.__cascade, maps=maps)
+
+
+    def pinpoint_targets(self, image, rows, cols):
+        # Pinpoint a batch of triggering indices at once. Returns arrays of
+        # (is_target, center_row, center_column, radius) with one entry per trigger.
+        blocks = self.__frame_threshholds(image)
+        threshholds = [self.__threshhold_at(r, c, blocks) for r, c in zip(rows, cols)]
+        return verify_crosses(image, rows, cols, self.__scan_offset, self.__target_offset, threshholds,
+                              self.__cascade, self.frame_maps(image))
+
+
+    def close(self):
+        # Shut down the worker pool, if any
+        if self.__pool:
+            self.__pool.close()
+            self.__pool = None
 
-                # If the horizontal bar goes outside the boundaries, return
-                if c < scan_offset[1] or c >= image.shape[1]:
-                    return (False, 0, 0, 0)
-
-                # Encounter left edge on first rising gradient
-                if gradient(image[r,c-scan_offset[1]], image[r,c]) > self.__threshhold:
-                    cross_encounter = True
-                    if not edge_trigger:
-                        edge_trigger = True
-                        left_right[0] = c
-
-                        # (DEBUG) Color rising edge blue
-                        # try:
-                        #     self.__rgb[r,c] = [0,0,255]
-                        # except:
-                        #     None
-
-                        # Define top for first edge hit
-                        if not top:
-                            top = r
-                            vbar_bounds[0] = c
-
-                # Encountered right edge on falling gradient after left edge
-                elif gradient(image[r,c-scan_offset[1]], image[r,c]) < -self.__threshhold:
-                    cross_encounter = True
-                    if edge_trigger:
-                        left_right[1] = c
-
-                        # (DEBUG) Color falling edge green
-                        # try:
-                        #     self.__rgb[r,c] = [0,255,0]
-                        # except:
-                        #     None
-
-                        # Mark the top right corner of the bar
-                        if top and not vbar_bounds[1]:
-                            vbar_bounds[1] = c
-
-                        continue
-
-                # For checking if we encountered the cross within the row
-                if top and image[r,c] < min_row_intensity:
-                    min_row_intensity = image[r,c]
-                    if min_row_intensity < min_intensity:
-                        min_intensity = min_row_intensity
-
-            if cross_encounter:
-                gradient_counter = 0
-
-            # If a black pixel was not encountered in this row, mark the bottom
-            elif top and not ((min_row_intensity - min_intensity) < self.__threshhold):
-                bottom = r - scan_offset[0]
-                vbar_bounds[2] = left_right[0]
-                vbar_bounds[3] = left_right[1]
-                break
-
-            else:
-                gradient_counter += 1
-
-            if gradient_counter > 1.5 * (initial_right - initial_left):
-                return (False, 0, 0, 0)
-
-        # If all of the features of the vertical bar were not detected, the feature
-        # is probably not a cross
-        if not top or not bottom or not all(vbar_bounds):
-            return (False, 0, 0, 0)
-
-        # If the top and bottom were not similar in width
-        if abs((vbar_bounds[1] - vbar_bounds[0]) - (vbar_bounds[3] - vbar_bounds[2])) > self.__target_offset:
-            return (False, 0, 0, 0)
-
-        center_row = (top + bottom) // 2
-        center_column = int(np.mean(vbar_bounds))
-        column_radius = (vbar_bounds[1] - vbar_bounds[0]) // 2
-
-        if (vbar_bounds[1] - vbar_bounds[0]) > 0.5 * (bottom - top):
-            return (False, 0, 0, 0)
-
-        left = None
-        right = None
-
-        # [top_left, bottom_left, top_right, bottom_right]
-        hbar_bounds = [None, None, None, None]
-
-        # Perform a vertical scan from the center until we find the left edge
-        up_down = [center_row - column_radius, center_row + column_radius]
-        for c in range(center_column - column_radius, 0, -scan_offset[1]):
-
-            if c < 0:
-                return (False, 0, 0, 0)
-
-            edge_trigger = False
-            cross_encounter = False
-            min_col_intensity = 255
-
-            for r in range(up_down[0] - self.__target_offset, up_down[1] + self.__target_offset, scan_offset[0]):
-
-                if r < 0 or r >= image.shape[0]:
-                    return (False, 0, 0, 0)
-
-                if gradient(image[r-scan_offset[0],c], image[r,c]) > self.__threshhold:
-                    cross_encounter = True
-                    if not edge_trigger:
-                        edge_trigger = True
-                        up_down[0] = r
-
-                        # (DEBUG) Color rising edge blue
-                        # try:
-                        #     self.__rgb[r,c] = [0,0,255]
-                        # except:
-                        #     None
-
-                elif gradient(image[r-scan_offset[0],c], image[r,c]) < -self.__threshhold:
-                    cross_encounter = True
-                    if edge_trigger:
-                        up_down[1] = r
-
-                        # (DEBUG) Color falling edge green
-                        # try:
-                        #     self.__rgb[r,c] = [0,255,0]
-                        # except:
-                        #     None
-
-                        continue
-
-                if image[r,c] < min_col_intensity:
-                    min_col_intensity = image[r,c]
-
-            if not cross_encounter and abs(min_col_intensity - min_intensity) > self.__threshhold:
-                left = c
-                hbar_bounds[0] = up_down[0]
-                hbar_bounds[1] = up_down[1]
-                break
-
-        # Perform a vertical scan from the center until we find the right edge
-        up_down = [center_row - column_radius, center_row + column_radius]
-        for c in range(center_column + column_radius, image.shape[1], scan_offset[1]):
-
-            if c >= image.shape[1]:
-                return (False, 0, 0, 0)
-
-            edge_trigger = False
-            cross_encounter = False
-            min_col_intensity = 255
-
-            for r in range(up_down[0] - self.__target_offset, up_down[1] + self.__target_offset, scan_offset[0]):
-
-                if r < 0 or r >= image.shape[0]:
-                    return (False, 0, 0, 0)
-
-                if gradient(image[r-scan_offset[0],c], image[r,c]) > self.__threshhold:
-                    cross_encounter = True
-                    if not edge_trigger:
-                        edge_trigger = True
-                        up_down[0] = r
-
-                        # (DEBUG) Color rising edge blue
-                        # try:
-                        #     self.__rgb[r,c] = [0,0,255]
-                        # except:
-                        #     None
-
-                elif gradient(image[r-scan_offset[0],c], image[r,c]) < -self.__threshhold:
-                    cross_encounter = True
-                    if edge_trigger:
-                        up_down[1] = r
-
-                        # (DEBUG) Color falling edge green
-                        # try:
-                        #     self.__rgb[r,c] = [0,255,0]
-                        # except:
-                        #     None
-
-                        continue
-
-                if image[r,c] < min_col_intensity:
-                    min_col_intensity = image[r,c]
-
-            if not cross_encounter and abs(min_col_intensity - min_intensity) > self.__threshhold:
-                right = c
-                hbar_bounds[2] = up_down[0]
-                hbar_bounds[3] = up_down[1]
-                break
-
-        # If all bounds were not satisfied
-        if not left or not right or not all(hbar_bounds):
-            return (False, 0, 0, 0)
-
-        # If the right and left sides were not close to the same width
-        if abs((hbar_bounds[1] - hbar_bounds[0]) - (hbar_bounds[3] - hbar_bounds[2])) > self.__target_offset:
-            return (False, 0, 0, 0)
-
-        if (hbar_bounds[1] - hbar_bounds[0]) > 0.5 * (right - left):
-            return (False, 0, 0, 0)
-
-        # Find true center column
-        center_column = (right + left) // 2
-
-        # Extract the vector cooresponding to the upwards vertical arm of the cross with
-        # the origin at the center
-        up_vec = np.array([(vbar_bounds[1] + vbar_bounds[0]) / 2 - center_column,  center_row - top])
-        if np.all((up_vec == 0)):
-            return (False, 0, 0, 0)
-        up_unit = up_vec / np.linalg.norm(up_vec)
-
-        # Extract downward vertical vector
-        down_vec = np.array([(vbar_bounds[3] + vbar_bounds[2]) / 2 - center_column, center_row - bottom])
-        if np.all((down_vec == 0)):
-            return (False, 0, 0, 0)
-        down_unit = down_vec / np.linalg.norm(down_vec)
-
-        # Extract right horizontal vector
-        right_vec = np.array([right - center_column, center_row - (hbar_bounds[3] + hbar_bounds[2]) / 2])
-        if np.all((right_vec == 0)):
-            return (False, 0, 0, 0)
-        right_unit = right_vec / np.linalg.norm(right_vec)
-
-        # Extract left horizontal vector
-        left_vec = np.array([left - center_column, center_row - (hbar_bounds[1] + hbar_bounds[0]) / 2])
-        if np.all((left_vec == 0)):
-            return (False, 0, 0, 0)
-        left_unit = left_vec / np.linalg.norm(left_vec)
-
-        # Check that vectors are about the same length
-        if abs(np.linalg.norm(up_vec) - np.linalg.norm(right_vec)) > 2 * self.__target_offset:
-            return (False, 0, 0, 0)
-
-        # Check that vectors are not tiny
-        if np.linalg.norm(down_vec) < self.__target_offset or np.linalg.norm(left_vec) < self.__target_offset:
-            return (False, 0, 0, 0)
-
-        # (DEBUG)
-        # print(up_vec)
-        # print(down_vec)
-        # print(right_vec)
-        # print(left_vec)
-
-        # Classify as not a cross if the angle is off by more than 15 degrees
-        if abs(np.dot(up_unit, right_unit)) > 0.25:
-            return (False, 0, 0, 0)
-
-        if abs(np.dot(up_unit, left_unit)) > 0.25:
-            return (False, 0, 0, 0)
-
-        if abs(np.dot(left_unit, down_unit)) > 0.25:
-            return (False, 0, 0, 0)
-
-        if abs(np.dot(right_unit, down_unit)) > 0.25:
-            return (False, 0, 0, 0)
-
-        # Classify as not a cross if the opposite ends are not approximately parallel
-        if abs(abs(np.dot(up_unit, down_unit)) - 1) > 0.1:
-            return (False, 0, 0, 0)
-
-        if abs(abs(np.dot(right_unit, left_unit)) - 1) > 0.1:
-            return (False, 0, 0, 0)
-
-        # (DEBUG) Draw lines on the bounds
-        # try:
-        #     self.__rgb[top,vbar_bounds[0]:vbar_bounds[1]] = [255,0,0]
-        #     self.__rgb[bottom,vbar_bounds[2]:vbar_bounds[3]] = [255,0,0]
-        #     self.__rgb[hbar_bounds[0]:hbar_bounds[1], left] = [255,0,0]
-        #     self.__rgb[hbar_bounds[2]:hbar_bounds[3], right] = [255,0,0]
-        # except:
-        #     None
-
-        return (True, center_row, center_column, max(bottom-top, right-left) // 2)
 
     def attach_rgb(self, rgb):
         # Link the RGB to the class object so we can draw on it.
         self.__rgb = rgb
+
+
+def frames_mapping(frames):
+    # (filename, offset, dtype, shape, order) of frames memory mapped straight
+    # from a file, such as an .npy file loaded with mmap_mode, or None
+    if not isinstance(frames, np.memmap) or not isinstance(frames.base, mmap.mmap) or not frames.filename:
+        return None
+    return (frames.filename, frames.offset, frames.dtype.str, frames.shape,
+            "F" if frames.flags.f_contiguous and not frames.flags.c_contiguous else "C")
+
+
+def track_segment(frames, start, stop, params, border=(10,10,10,10), scan_period=50, incremental=False):
+    # Track frames[start:stop] with a new tracker built from params, the first
+    # frame being scanned. frames is an array or the frames_mapping of a file,
+    # of which only the segment is read. Returns the get_target_array of every
+    # frame.
+    if isinstance(frames, tuple):
+        filename, offset, dtype, shape, order = frames
+        frames = np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+    segment_tracker = Tracker(**params)
+    arrays = []
+    for frame_counter, image in enumerate(frames[start:stop]):
+        segment_tracker.track_frame(image, frame_counter, border, scan_period, incremental)
+        arrays.append(segment_tracker.get_target_array())
+    return arrays
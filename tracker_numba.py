@@ -0,0 +1,461 @@
+import numpy as np
+
+from tracker_stats import (ACCEPTED, NO_EDGE, OUT_OF_BOUNDS, LOST_BAR, INCOMPLETE_BAR, WIDTH_MISMATCH, ASPECT,
+                           ARM_LENGTH, ANGLE, PARALLELISM, SHORT_BAR, NO_ARMS)
+
+# Optional compiled backend for the tracker hot loops. The edge following in
+# pinpoint_target is sequential (every row's search window depends on the
+# previous row), so it is compiled as plain loops instead of vectorized.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+available = numba is not None
+
+# Length of a target geometry: (top, bottom, left, right), the vertical bar bounds
+# (top_left, top_right, bottom_left, bottom_right), the horizontal bar bounds
+# (top_left, bottom_left, top_right, bottom_right) and the (row, col) of the
+# trigger the target was traced from
+GEOMETRY_SIZE = 14
+
+
+def jit(function):
+    # Compile with numba when it is installed, otherwise leave the function alone
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@jit
+def pinpoint_target(image, row, col, scan_offset_row, scan_offset_col, target_offset, threshhold, cascade):
+    # Compiled version of the scalar pinpoint_target sweeps
+    geometry = np.zeros(GEOMETRY_SIZE, dtype=np.int64)
+    return pinpoint_geometry(image, row, col, scan_offset_row, scan_offset_col, target_offset, threshhold, geometry,
+                             cascade)
+
+
+@jit
+def cascade_rejection(image, row, left, right, step_row, step_col, target_offset, threshhold, cascade):
+    # Compiled version of the early-reject cascade of the Python backend
+    height = image.shape[0]
+    width = image.shape[1]
+    bar_width = right - left
+    bar_col = left
+    for c in range(left, max(right, left + 1)):
+        if image[row, c] < image[row, bar_col]:
+            bar_col = c
+    level = np.int64(image[row, left - step_col]) - threshhold
+
+    # Dark run down the bar through row, bridging gaps of up to step_row pixels
+    top = row
+    bottom = row
+    if np.int64(image[row, bar_col]) < level:
+        r = row - 1
+        while r >= 0 and top - r <= step_row + 1:
+            if np.int64(image[r, bar_col]) < level:
+                top = r
+            r -= 1
+        r = row + 1
+        while r < height and r - bottom <= step_row + 1:
+            if np.int64(image[r, bar_col]) < level:
+                bottom = r
+            r += 1
+
+    for stage in cascade:
+        if stage == SHORT_BAR:
+            if 2 * bar_width > bottom - top + 1 + 2 * target_offset:
+                return SHORT_BAR
+
+        elif stage == NO_ARMS:
+            center_row = (top + bottom) // 2
+            arm = max((bottom - top) // 2 - 2 * target_offset, 0) // 2
+            corner = max((bottom - top) // 4, bar_width)
+            reach = max(arm, corner)
+            if center_row - corner < 0 or center_row + corner >= height or \
+                    bar_col - reach < 0 or bar_col + reach >= width:
+                return NO_ARMS
+            if not (np.int64(image[center_row, bar_col - arm]) < level and
+                    np.int64(image[center_row, bar_col + arm]) < level):
+                return NO_ARMS
+            for r in (center_row - corner, center_row + corner):
+                for c in (bar_col - corner, bar_col + corner):
+                    if np.int64(image[r, c]) < level:
+                        return NO_ARMS
+
+    return ACCEPTED
+
+
+@jit
+def pinpoint_geometry(image, row, col, scan_offset_row, scan_offset_col, target_offset, threshhold, geometry,
+                      cascade):
+    # pinpoint_target that also writes the bounds of a target it finds to the
+    # geometry array, like verify_cross. Bounds that were None in the Python
+    # version use 0, which is just as falsy. The stages of cascade run before the
+    # bars are traced.
+    height = image.shape[0]
+    width = image.shape[1]
+    s0 = (scan_offset_row + 1) // 2
+    s1 = (scan_offset_col + 1) // 2
+
+    # Determine the initial scan width
+    initial_left = 0
+    for c in range(col, 0, -s1):
+        if np.int64(image[row, c - s1]) - np.int64(image[row, c]) > threshhold:
+            initial_left = c
+            break
+
+    if not initial_left:
+        return (False, 0, 0, NO_EDGE)
+
+    initial_right = 0
+    for c in range(col, width, s1):
+        if np.int64(image[row, c - s1]) - np.int64(image[row, c]) < -threshhold:
+            initial_right = c
+            break
+
+    if not initial_right:
+        return (False, 0, 0, NO_EDGE)
+
+    if len(cascade):
+        rejection = cascade_rejection(image, row, initial_left, initial_right, s0, s1, target_offset, threshhold,
+                                      cascade)
+        if rejection:
+            return (False, 0, 0, rejection)
+
+    # [top_left, top_right, bottom_left, bottom_right]
+    vbar_0 = 0
+    vbar_1 = 0
+    vbar_2 = 0
+    vbar_3 = 0
+    top = 0
+    bottom = 0
+    min_intensity = 255.0
+    left_0 = initial_left
+    left_1 = initial_right
+    gradient_counter = 0
+
+    for r in range(row - target_offset, height, s0):
+        if r < 0:
+            return (False, 0, 0, OUT_OF_BOUNDS)
+
+        edge_trigger = False
+        cross_encounter = False
+        min_row_intensity = 255.0
+
+        for c in range(left_0 - target_offset, left_1 + target_offset, s1):
+            if c < s1 or c >= width:
+                return (False, 0, 0, OUT_OF_BOUNDS)
+
+            g = np.int64(image[r, c - s1]) - np.int64(image[r, c])
+            if g > threshhold:
+                cross_encounter = True
+                if not edge_trigger:
+                    edge_trigger = True
+                    left_0 = c
+                    if not top:
+                        top = r
+                        vbar_0 = c
+
+            elif g < -threshhold:
+                cross_encounter = True
+                if edge_trigger:
+                    left_1 = c
+                    if top and not vbar_1:
+                        vbar_1 = c
+                    continue
+
+            if top and image[r, c] < min_row_intensity:
+                min_row_intensity = float(image[r, c])
+                if min_row_intensity < min_intensity:
+                    min_intensity = min_row_intensity
+
+        if cross_encounter:
+            gradient_counter = 0
+
+        elif top and not ((min_row_intensity - min_intensity) < threshhold):
+            bottom = r - s0
+            vbar_2 = left_0
+            vbar_3 = left_1
+            break
+
+        else:
+            gradient_counter += 1
+
+        if gradient_counter > 1.5 * (initial_right - initial_left):
+            return (False, 0, 0, LOST_BAR)
+
+    if not top or not bottom or not vbar_0 or not vbar_1 or not vbar_2 or not vbar_3:
+        return (False, 0, 0, INCOMPLETE_BAR)
+
+    if abs((vbar_1 - vbar_0) - (vbar_3 - vbar_2)) > target_offset:
+        return (False, 0, 0, WIDTH_MISMATCH)
+
+    center_row = (top + bottom) // 2
+    center_column = int((vbar_0 + vbar_1 + vbar_2 + vbar_3) / 4)
+    column_radius = (vbar_1 - vbar_0) // 2
+
+    if (vbar_1 - vbar_0) > 0.5 * (bottom - top):
+        return (False, 0, 0, ASPECT)
+
+    # Vertical scans from the center until we find the left (side = -1) and
+    # right (side = 1) edges. [top_left, bottom_left, top_right, bottom_right]
+    left = 0
+    right = 0
+    hbar = np.zeros(4, dtype=np.int64)
+    for side in (-1, 1):
+        up_0 = center_row - column_radius
+        up_1 = center_row + column_radius
+        if side < 0:
+            start = center_column - column_radius
+            stop = 0
+        else:
+            start = center_column + column_radius
+            stop = width
+
+        for c in range(start, stop, side * s1):
+            if c < 0 or c >= width:
+                return (False, 0, 0, OUT_OF_BOUNDS)
+
+            edge_trigger = False
+            cross_encounter = False
+            min_col_intensity = 255.0
+
+            for r in range(up_0 - target_offset, up_1 + target_offset, s0):
+                if r < 0 or r >= height:
+                    return (False, 0, 0, OUT_OF_BOUNDS)
+
+                g = np.int64(image[r - s0, c]) - np.int64(image[r, c])
+                if g > threshhold:
+                    cross_encounter = True
+                    if not edge_trigger:
+                        edge_trigger = True
+                        up_0 = r
+
+                elif g < -threshhold:
+                    cross_encounter = True
+                    if edge_trigger:
+                        up_1 = r
+                        continue
+
+                if image[r, c] < min_col_intensity:
+                    min_col_intensity = float(image[r, c])
+
+            if not cross_encounter and abs(min_col_intensity - min_intensity) > threshhold:
+                if side < 0:
+                    left = c
+                    hbar[0] = up_0
+                    hbar[1] = up_1
+                else:
+                    right = c
+                    hbar[2] = up_0
+                    hbar[3] = up_1
+                break
+
+    if not left or not right:
+        return (False, 0, 0, OUT_OF_BOUNDS)
+
+    if not hbar[0] or not hbar[1] or not hbar[2] or not hbar[3]:
+        return (False, 0, 0, INCOMPLETE_BAR)
+
+    if abs((hbar[1] - hbar[0]) - (hbar[3] - hbar[2])) > target_offset:
+        return (False, 0, 0, WIDTH_MISMATCH)
+
+    if (hbar[1] - hbar[0]) > 0.5 * (right - left):
+        return (False, 0, 0, ASPECT)
+
+    center_column = (right + left) // 2
+
+    # Arm vectors with the origin at the center: up, down, right, left
+    arms = np.empty((4, 2))
+    arms[0, 0] = (vbar_1 + vbar_0) / 2 - center_column
+    arms[0, 1] = center_row - top
+    arms[1, 0] = (vbar_3 + vbar_2) / 2 - center_column
+    arms[1, 1] = center_row - bottom
+    arms[2, 0] = right - center_column
+    arms[2, 1] = center_row - (hbar[3] + hbar[2]) / 2
+    arms[3, 0] = left - center_column
+    arms[3, 1] = center_row - (hbar[1] + hbar[0]) / 2
+
+    lengths = np.empty(4)
+    for i in range(4):
+        if arms[i, 0] == 0 and arms[i, 1] == 0:
+            return (False, 0, 0, ARM_LENGTH)
+        lengths[i] = np.sqrt(arms[i, 0] * arms[i, 0] + arms[i, 1] * arms[i, 1])
+
+    if abs(lengths[0] - lengths[2]) > 2 * target_offset:
+        return (False, 0, 0, ARM_LENGTH)
+
+    if lengths[1] < target_offset or lengths[3] < target_offset:
+        return (False, 0, 0, ARM_LENGTH)
+
+    units = np.empty((4, 2))
+    for i in range(4):
+        units[i, 0] = arms[i, 0] / lengths[i]
+        units[i, 1] = arms[i, 1] / lengths[i]
+
+    # Classify as not a cross if the angle is off by more than 15 degrees
+    for a, b in ((0, 2), (0, 3), (3, 1), (2, 1)):
+        if abs(units[a, 0] * units[b, 0] + units[a, 1] * units[b, 1]) > 0.25:
+            return (False, 0, 0, ANGLE)
+
+    # Classify as not a cross if the opposite ends are not approximately parallel
+    for a, b in ((0, 1), (2, 3)):
+        if abs(abs(units[a, 0] * units[b, 0] + units[a, 1] * units[b, 1]) - 1) > 0.1:
+            return (False, 0, 0, PARALLELISM)
+
+    geometry[0] = top
+    geometry[1] = bottom
+    geometry[2] = left
+    geometry[3] = right
+    geometry[4] = vbar_0
+    geometry[5] = vbar_1
+    geometry[6] = vbar_2
+    geometry[7] = vbar_3
+    geometry[8:12] = hbar
+    geometry[12] = row
+    geometry[13] = col
+    return (True, center_row, center_column, max(bottom - top, right - left) // 2)
+
+
+@jit
+def scan_triggers(image, trigger_rows, trigger_cols, scan_offset_row, scan_offset_col, target_offset, threshholds,
+                  cascade, reasons):
+    # Pinpoint the trigger points of a scan in raster order, each with its own
+    # threshhold, skipping triggers inside targets found earlier in the same scan. Returns the number of targets
+    # found and an (n, 5) array of
+    # (trigger_row, trigger_col, center_row, center_column, radius). The reason
+    # code of every pinpointed trigger is written to reasons.
+    found = np.zeros((len(trigger_rows), 5), dtype=np.int64)
+    count = 0
+    for i in range(len(trigger_rows)):
+        r = trigger_rows[i]
+        c = trigger_cols[i]
+        inside_target = False
+        for t in range(count):
+            if (found[t, 2] - found[t, 4]) < r < (found[t, 2] + found[t, 4]) and \
+                    (found[t, 3] - found[t, 4]) < c < (found[t, 3] + found[t, 4]):
+                inside_target = True
+                break
+
+        if inside_target:
+            continue
+
+        is_target, center_row, center_column, radius = pinpoint_target(
+            image, r, c, scan_offset_row, scan_offset_col, target_offset, threshholds[i], cascade)
+        reasons[i] = 0 if is_target else radius
+        if is_target:
+            found[count, 0] = r
+            found[count, 1] = c
+            found[count, 2] = center_row
+            found[count, 3] = center_column
+            found[count, 4] = radius
+            count += 1
+
+    return count, found
+
+
+@jit
+def first_target(image, trigger_rows, trigger_cols, scan_offset_row, scan_offset_col, target_offset, threshhold,
+                 geometry, cascade, reasons):
+    # Pinpoint the trigger points in order and stop at the first confirmed target,
+    # writing the reason code of every pinpointed trigger to reasons
+    for i in range(len(trigger_rows)):
+        is_target, center_row, center_column, radius = pinpoint_geometry(
+            image, trigger_rows[i], trigger_cols[i], scan_offset_row, scan_offset_col, target_offset, threshhold,
+            geometry, cascade)
+        reasons[i] = 0 if is_target else radius
+        if is_target:
+            return (True, center_row, center_column, radius)
+
+    return (False, 0, 0, 0)
+
+
+@jit
+def bar_edges(line, start, stop, step, threshhold):
+    # Sides of a dark bar crossing line[start:stop:step]: the first rising
+    # gradient and the first falling gradient after it, or (0, 0)
+    rising = 0
+    for i in range(start, stop, step):
+        g = np.int64(line[i - step]) - np.int64(line[i])
+        if not rising:
+            if g > threshhold:
+                rising = i
+        elif g < -threshhold:
+            return (rising, i)
+
+    return (0, 0)
+
+
+@jit
+def in_bounds(is_target, geometry, top, bottom, left, right, margin):
+    # Whether a traced target has its bounds within margin of the given ones
+    return is_target and abs(geometry[0] - top) <= margin and abs(geometry[1] - bottom) <= margin and \
+        abs(geometry[2] - left) <= margin and abs(geometry[3] - right) <= margin
+
+
+@jit
+def probe_cross(image, previous, shift_row, shift_col, margin, scan_offset_row, scan_offset_col, target_offset,
+                threshhold, geometry):
+    # Compiled version of probe_cross
+    height = image.shape[0]
+    width = image.shape[1]
+    s0 = (scan_offset_row + 1) // 2
+    s1 = (scan_offset_col + 1) // 2
+
+    top = previous[0] + shift_row
+    bottom = previous[1] + shift_row
+    left = previous[2] + shift_col
+    right = previous[3] + shift_col
+    center_row = (top + bottom) // 2
+    center_column = (left + right) // 2
+    up_row = (top + center_row) // 2
+    down_row = (bottom + center_row) // 2
+    left_col = (left + center_column) // 2
+    right_col = (right + center_column) // 2
+    trigger_row = previous[12] + (shift_row + s0 // 2) // s0 * s0
+    trigger_col = previous[13] + (shift_col + s1 // 2) // s1 * s1
+    if up_row < 0 or down_row >= height or left_col < 0 or right_col >= width or \
+            trigger_row < 0 or trigger_row >= height or trigger_col <= 0 or trigger_col >= width:
+        return (False, 0, 0, 0)
+
+    up_0, up_1 = bar_edges(image[up_row], max(previous[4] + shift_col - margin, s1),
+                           min(previous[5] + shift_col + margin, width), s1, threshhold)
+    down_0, down_1 = bar_edges(image[down_row], max(previous[6] + shift_col - margin, s1),
+                               min(previous[7] + shift_col + margin, width), s1, threshhold)
+    left_0, left_1 = bar_edges(image[:, left_col], max(previous[8] + shift_row - margin, s0),
+                               min(previous[9] + shift_row + margin, height), s0, threshhold)
+    right_0, right_1 = bar_edges(image[:, right_col], max(previous[10] + shift_row - margin, s0),
+                                 min(previous[11] + shift_row + margin, height), s0, threshhold)
+    if not up_0 or not down_0 or not left_0 or not right_0:
+        return (False, 0, 0, 0)
+
+    if abs((up_1 - up_0) - (previous[5] - previous[4])) > target_offset or \
+            abs((down_1 - down_0) - (previous[7] - previous[6])) > target_offset or \
+            abs((left_1 - left_0) - (previous[9] - previous[8])) > target_offset or \
+            abs((right_1 - right_0) - (previous[11] - previous[10])) > target_offset:
+        return (False, 0, 0, 0)
+
+    # Trace the target from its previous trigger, moved with it, and again
+    # further up the bar, from its middle, while the top is on the first row
+    # traced. Traces that stray more than margin from the moved bounds are
+    # rejected.
+    cascade = np.zeros(0, dtype=np.int64)
+    rise = s0 * ((target_offset + s0 - 1) // s0)
+    found = pinpoint_geometry(image, trigger_row, trigger_col, scan_offset_row, scan_offset_col, target_offset,
+                              threshhold, geometry, cascade)
+    while in_bounds(found[0], geometry, top, bottom, left, right, margin) and \
+            geometry[0] <= trigger_row - target_offset and trigger_row >= rise:
+        previous_geometry = geometry.copy()
+        higher = pinpoint_geometry(image, trigger_row - rise, (up_0 + up_1) // 2, scan_offset_row, scan_offset_col,
+                                   target_offset, threshhold, geometry, cascade)
+        if not in_bounds(higher[0], geometry, top, bottom, left, right, margin) or \
+                geometry[0] == previous_geometry[0]:
+            geometry[:] = previous_geometry
+            return found
+        found = higher
+        trigger_row -= rise
+
+    if not in_bounds(found[0], geometry, top, bottom, left, right, margin):
+        return (False, 0, 0, 0)
+    return found
@@ -0,0 +1,138 @@
+import collections
+import threading
+
+import numpy as np
+
+# Per frame instrumentation of the tracker. Rejected pinpoints return
+# (False, 0, 0, reason) with one of the reason codes below, so counting them
+# costs nothing when the tracker runs without stats.
+
+ACCEPTED = 0
+NO_EDGE = 1          # no rising or falling edge next to the trigger
+OUT_OF_BOUNDS = 2    # a sweep left the image
+LOST_BAR = 3         # the vertical bar faded out before its bottom was found
+INCOMPLETE_BAR = 4   # a bar bound was never found
+WIDTH_MISMATCH = 5   # the ends of a bar have different widths
+ASPECT = 6           # a bar is too wide for its length
+ARM_LENGTH = 7       # arms missing, too short or of different lengths
+ANGLE = 8            # arms not perpendicular
+PARALLELISM = 9      # opposite arms not parallel
+SHORT_BAR = 10       # cascade: the dark run along the bar is too short for its width
+NO_ARMS = 11         # cascade: no arms or no bright corners around the middle of the bar
+
+REASONS = ("accepted", "no_edge", "out_of_bounds", "lost_bar", "incomplete_bar", "width_mismatch", "aspect",
+           "arm_length", "angle", "parallelism", "short_bar", "no_arms")
+
+# Stages of the early-reject cascade by name, see tracker.cascade_rejection
+STAGES = {"bar": SHORT_BAR, "arms": NO_ARMS}
+
+
+class FrameStats:
+    # Counters and timings of one frame. Times are in seconds. cascade is the
+    # order of the early-reject stages the tracker runs, to report their pass
+    # rates.
+    def __init__(self, cascade=()):
+        self.cascade = tuple(cascade)
+        self.gradient_evaluations = 0
+        self.triggers = 0
+        self.pinpoint_calls = 0
+        self.results = np.zeros(len(REASONS), dtype=np.int64)
+        self.probes = 0
+        self.probe_failures = 0
+        self.scan_time = 0.0
+        self.update_time = 0.0
+        self.pinpoint_time = 0.0
+        self.pinpoint_times = []
+
+    def count_pinpoint(self, result, duration=None):
+        # Count a pinpoint result, (is_target, center_row, center_col, radius or
+        # reason), and its duration when timed
+        self.pinpoint_calls += 1
+        self.results[ACCEPTED if result[0] else result[3]] += 1
+        if duration is not None:
+            self.pinpoint_time += duration
+            self.pinpoint_times.append(duration)
+
+    def count_reasons(self, reasons):
+        # Count an array of pinpoint reason codes, -1 for triggers that were not
+        # pinpointed (the compiled backend does not time single calls)
+        reasons = reasons[reasons >= 0]
+        self.pinpoint_calls += len(reasons)
+        self.results += np.bincount(reasons, minlength=len(REASONS))
+
+    def merge(self, other):
+        # Add the counters and timings of another FrameStats, e.g. from a worker
+        for name, value in vars(other).items():
+            if name == "cascade":
+                continue
+            if name == "pinpoint_times":
+                self.pinpoint_times.extend(value)
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+    def rejections(self):
+        # Number of pinpoint rejections by reason
+        return {reason: int(count) for reason, count in zip(REASONS[1:], self.results[1:])}
+
+    def stages(self):
+        # (name, entered, passed) of every stage a pinpoint goes through: the
+        # edges next to the trigger, the cascade stages in order and the full
+        # verification
+        stages = [("edge", NO_EDGE)] + [(name, STAGES[name]) for name in self.cascade]
+        entered = self.pinpoint_calls
+        counts = []
+        for name, reason in stages:
+            passed = entered - int(self.results[reason])
+            counts.append((name, entered, passed))
+            entered = passed
+        counts.append(("verify", entered, int(self.results[ACCEPTED])))
+        return counts
+
+    def as_dict(self):
+        stats = {name: value for name, value in vars(self).items()
+                 if name not in ("cascade", "results", "pinpoint_times")}
+        stats["targets_confirmed"] = int(self.results[ACCEPTED])
+        stats["rejections"] = self.rejections()
+        stats["stages"] = {name: {"entered": entered, "passed": passed} for name, entered, passed in self.stages()}
+        return stats
+
+    def summary(self):
+        rejections = ", ".join("%s %d" % (reason, count) for reason, count in self.rejections().items() if count)
+        stages = ", ".join("%s %d/%d" % stage for stage in self.stages())
+        return ("%d gradients, %d triggers, %d pinpoints (%.2f ms) -> %d confirmed, %d probes (%d failed), "
+                "scan %.2f ms, update %.2f ms; rejected: %s; stages passed: %s" % (
+                    self.gradient_evaluations, self.triggers, self.pinpoint_calls, self.pinpoint_time * 1000,
+                    self.results[ACCEPTED], self.probes, self.probe_failures, self.scan_time * 1000,
+                    self.update_time * 1000, rejections or "none", stages))
+
+
+class StatsHistory:
+    # Ring buffer of the stats of the last frames. The tracking thread appends
+    # while another thread may report, so both go through a lock.
+    def __init__(self, size):
+        self.__frames = collections.deque(maxlen=size)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__frames)
+
+    def append(self, stats):
+        with self.__lock:
+            self.__frames.append(stats)
+
+    def total(self):
+        # FrameStats of all the frames in the buffer added together
+        with self.__lock:
+            frames = list(self.__frames)
+        total = FrameStats(frames[-1].cascade if frames else ())
+        for stats in frames:
+            total.merge(stats)
+        return total
+
+
+def instrumented_task(frame, function, *args):
+    # Run function(frame, *args, stats=...) with its own FrameStats, for worker
+    # pools where the stats of the caller cannot be shared. Returns (result, stats).
+    stats = FrameStats()
+    return function(frame, *args, stats=stats), stats
@@ -0,0 +1,91 @@
+import concurrent.futures
+import os
+
+import numpy as np
+
+# Worker pools that run many tasks over the same frame. Thread pools share the
+# frame directly. Process pools copy the frame once into shared memory and every
+# worker maps it, so no task pickles the image.
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Shared memory blocks attached by this worker process, by name
+_attached = {}
+
+
+def _frame_task(name, shape, dtype, function, args):
+    # Run function(frame, *args) in a worker process on the shared frame
+    block = _attached.get(name)
+    if block is None:
+        # Drop blocks of older frames before attaching the new one
+        for old in _attached.values():
+            old.close()
+        _attached.clear()
+        block = shared_memory.SharedMemory(name=name)
+        _attached[name] = block
+
+    frame = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return function(frame, *args)
+
+
+class WorkerPool:
+    def __init__(self, workers=None, kind="thread"):
+        # Pool of workers, either "thread" or "process". Tasks must be module level
+        # functions when using processes.
+        if kind not in ("thread", "process"):
+            raise ValueError("Unknown worker pool kind: %s" % kind)
+        if kind == "process" and shared_memory is None:
+            raise RuntimeError("Process worker pools need multiprocessing.shared_memory (Python 3.8+)")
+
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        self.__block = None
+        if kind == "thread":
+            self.__executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        else:
+            self.__executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+
+    def __share(self, frame):
+        # Copy the frame into the shared block, reallocating it when the frame
+        # does not fit. A new block name tells the workers to attach again.
+        if self.__block is None or self.__block.size < frame.nbytes:
+            self.__release()
+            self.__block = shared_memory.SharedMemory(create=True, size=max(frame.nbytes, 1))
+
+        shared = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.__block.buf)
+        shared[...] = frame
+        return self.__block.name
+
+    def map_frame(self, function, frame, args_list):
+        # Run function(frame, *args) for every args of args_list and return the
+        # results in the same order
+        if not args_list:
+            return []
+
+        if self.kind == "thread":
+            futures = [self.__executor.submit(function, frame, *args) for args in args_list]
+        else:
+            name = self.__share(np.ascontiguousarray(frame))
+            futures = [self.__executor.submit(_frame_task, name, frame.shape, frame.dtype.str, function, args)
+                       for args in args_list]
+
+        return [f.result() for f in futures]
+
+    def map(self, function, args_list):
+        # Run function(*args) for every args of args_list and return the results
+        # in the same order
+        futures = [self.__executor.submit(function, *args) for args in args_list]
+        return [f.result() for f in futures]
+
+    def __release(self):
+        if self.__block is not None:
+            self.__block.close()
+            self.__block.unlink()
+            self.__block = None
+
+    def close(self):
+        self.__executor.shutdown()
+        self.__release()